@@ -6,7 +6,9 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
-from ._method import beta_phylogenetic, beta, plot
+from ._method import (beta_phylogenetic, beta, beta_phylogenetic_many,
+                      beta_many, beta_stratified, extend, query, beta_pairs,
+                      pcoa_landmark, plot)
 from ._version import get_versions
 
 
@@ -14,4 +16,6 @@ __version__ = get_versions()['version']
 del get_versions
 
 
-__all__ = ['beta', 'beta_phylogenetic', 'plot']
+__all__ = ['beta', 'beta_phylogenetic', 'beta_many', 'beta_phylogenetic_many',
+           'beta_stratified', 'beta_pairs', 'extend', 'query',
+           'pcoa_landmark', 'plot']
@@ -0,0 +1,150 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# Opt-in on-disk cache of computed distance matrices. Entries are keyed by
+# the content of everything that determines the result, and the least
+# recently used entries are evicted once the cache outgrows its size limit.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import scipy.sparse
+
+
+def _update_ids(digest, ids):
+    digest.update("\n".join(str(i) for i in ids).encode('utf-8'))
+    digest.update(b"\0")
+
+
+def table_digest(table):
+    digest = hashlib.sha256()
+    _update_ids(digest, table.ids(axis='observation'))
+    _update_ids(digest, table.ids(axis='sample'))
+    data = scipy.sparse.csr_matrix(table.matrix_data, dtype=np.float64)
+    data.sum_duplicates()
+    data.sort_indices()
+    for array in (data.indptr, data.indices, data.data):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def tree_digest(tree):
+    # tree is a _tree.CompactTree, which hashes its own arrays
+    return '' if tree is None else tree.digest
+
+
+def engine_digest(engine):
+    # The EBD binary is identified by its content, so rebuilding or upgrading
+    # it invalidates earlier results. In-process engines are identified by the
+    # plugin version.
+    if engine != 'ebd':
+        import q2_ebd
+        return '%s-%s' % (engine, q2_ebd.__version__)
+    binary = shutil.which('ExpressBetaDiversity')
+    if binary is None:
+        return 'ebd-missing'
+    digest = hashlib.sha256()
+    with open(binary, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(chunk)
+    return 'ebd-' + digest.hexdigest()
+
+
+def cache_key(table_hash, tree_hash, calculator, weighted, engine_hash,
+              precision='float64'):
+    return hashlib.sha256(("%s|%s|%s|%s|%s|%s" % (
+        table_hash, tree_hash, calculator, bool(weighted), engine_hash,
+        precision)).encode('utf-8')).hexdigest()
+
+
+def _touch(path):
+    # The entry may have been evicted since it was read
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+class DistanceMatrixCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        # Returns the condensed distances stored under key, or None
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                dists = entry['dists']
+        except (OSError, KeyError, ValueError):
+            return None
+        # Touch the entry so that eviction sees it as recently used
+        _touch(path)
+        return dists
+
+    def put(self, key, dists, ids):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            np.savez(fh, dists=dists, ids=np.array(ids))
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        # Other threads and processes sharing the directory may evict the
+        # same entries concurrently, so entries can vanish at any point.
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class OrdinationCache(DistanceMatrixCache):
+    # Principal coordinates of distance matrix artifacts, keyed by the
+    # artifact UUID and the number of axes
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                entry = {name: entry[name] for name in
+                         ('ids', 'coordinates', 'eigvals', 'proportions')}
+        except (OSError, KeyError, ValueError):
+            return None
+        _touch(path)
+        return entry
+
+    def put(self, key, ordination):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            np.savez(fh, ids=np.array([str(i) for i in
+                                       ordination.samples.index]),
+                     coordinates=ordination.samples.values,
+                     eigvals=ordination.eigvals.values,
+                     proportions=ordination.proportion_explained.values)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
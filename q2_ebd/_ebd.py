@@ -0,0 +1,222 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# Shuttling between QIIME's objects and the files ExpressBetaDiversity reads
+# and writes.
+
+import atexit
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+import scipy.sparse
+
+from q2_ebd import _matrix
+
+
+# Upper bound on the number of table cells densified at once while writing
+CHUNK_CELLS = 2 ** 20
+
+# Number of Newick files kept per directory by newick_file
+NEWICK_FILES = 8
+
+# Characters that force a Newick label to be quoted
+_NEWICK_OPERATORS = set(",:_;()[]")
+
+# Directory used by newick_file when no directory is given, created on first
+# use and removed when the process exits
+_newick_dir = None
+
+# Guards the Newick directories against concurrent calls of this process
+_newick_lock = threading.Lock()
+
+
+def write_table(table, table_fp):
+    # Samples are written in chunks of rows straight from the sparse matrix.
+    # Each distinct count in a chunk is formatted once and the rows are
+    # joined from those strings. Integer counts are written without a
+    # trailing ".0".
+    data = scipy.sparse.csr_matrix(table.matrix_data.T)
+    integral = np.all(np.mod(data.data, 1) == 0)
+    label = ('%d' if integral else '%r').__mod__
+    chunk_rows = max(1, CHUNK_CELLS // max(1, data.shape[1]))
+    sample_ids = table.ids(axis='sample')
+    with open(table_fp, 'w') as out_table:
+        out_table.write("\t" + "\t".join(table.ids(axis='observation')))
+        for start in range(0, data.shape[0], chunk_rows):
+            block = data[start:start + chunk_rows].toarray()
+            values, inverse = np.unique(block, return_inverse=True)
+            labels = np.array([label(v) for v in values.tolist()],
+                              dtype=object)
+            cells = labels[inverse.reshape(block.shape)].tolist()
+            out_table.write("".join(
+                "\n%s\t" % sample_id + "\t".join(row)
+                for sample_id, row in zip(sample_ids[start:], cells)))
+
+
+def _newick_label(name):
+    # Same quoting rules as scikit-bio's Newick writer
+    if name is None or name == '':
+        return ''
+    name = str(name)
+    escaped = name.replace("'", "''")
+    if any(c in _NEWICK_OPERATORS for c in name):
+        return "'%s'" % escaped
+    return escaped.replace(" ", "_")
+
+
+def write_tree(tree, newick_fp):
+    # Serializes a _tree.CompactTree without walking node objects. In
+    # postorder every node is written as its label and length, preceded by
+    # the "(" of each internal node whose subtree starts there, by ")" if it
+    # is internal itself, and followed by "," unless it is the last child.
+    n = len(tree)
+    internal = ~tree.is_tip
+    starts = (np.arange(n) - tree.size + 1)[internal]
+    opens = np.bincount(starts, minlength=n)
+    last_child = np.zeros(n, dtype=bool)
+    last_child[tree.children[tree.child_ptr[1:][internal] - 1]] = True
+    last_child[n - 1] = True
+    # NaN (an unset length) is the only value not equal to itself
+    lengths = [':%r' % length if length == length else ''
+               for length in tree.lengths.tolist()]
+    tokens = ("(" * o + (")" if i else "") + _newick_label(name) + length +
+              ("" if last else ",")
+              for o, i, name, length, last
+              in zip(opens.tolist(), internal.tolist(), tree.names, lengths,
+                     last_child.tolist()))
+    with open(newick_fp, 'w') as newick:
+        newick.write("".join(tokens) + ";\n")
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _link(source_fp, target_fp):
+    # Hard links are free; directories on different filesystems need a copy.
+    # Either raises FileNotFoundError if source_fp does not exist.
+    try:
+        os.link(source_fp, target_fp)
+    except OSError:
+        shutil.copyfile(source_fp, target_fp)
+
+
+def newick_file(tree, work_dir, directory=None):
+    # Returns the path of a Newick file for tree in work_dir, which belongs
+    # to the calling computation, so no other call can remove it while
+    # ExpressBetaDiversity reads it. directory keeps a copy of the files
+    # named after the tree digest, so that repeated calls and metrics on
+    # the same tree only serialize it once. The least recently used copies
+    # beyond NEWICK_FILES are removed; other threads and processes sharing
+    # the directory may remove them at any time too.
+    global _newick_dir
+    with _newick_lock:
+        if directory is None:
+            if _newick_dir is None:
+                _newick_dir = tempfile.mkdtemp(prefix='q2-ebd-trees-')
+                atexit.register(shutil.rmtree, _newick_dir, True)
+            directory = _newick_dir
+    os.makedirs(directory, exist_ok=True)
+    newick_fp = os.path.join(work_dir, tree.digest + '.newick')
+    cached_fp = os.path.join(directory, tree.digest + '.newick')
+    with _newick_lock:
+        try:
+            _link(cached_fp, newick_fp)
+        except FileNotFoundError:
+            pass
+        else:
+            _touch(cached_fp)
+            return newick_fp
+    write_tree(tree, newick_fp)
+    with _newick_lock:
+        fd, tmp_fp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(newick_fp, tmp_fp)
+        os.replace(tmp_fp, cached_fp)
+        newicks = []
+        for name in os.listdir(directory):
+            if name.endswith('.newick'):
+                try:
+                    newicks.append(
+                        (os.stat(os.path.join(directory, name)).st_mtime,
+                         name))
+                except FileNotFoundError:
+                    pass
+        for _, name in sorted(newicks)[:-NEWICK_FILES]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return newick_fp
+
+
+def _diss_chunks(dist_file):
+    # Yields the ids and the concatenated distances of consecutive chunks of
+    # rows of the lower triangle, parsed in bulk by NumPy.
+    while True:
+        lines = dist_file.readlines(CHUNK_CELLS * 16)
+        if not lines:
+            return
+        ids, rests = zip(*(line.partition("\t")[::2] for line in lines))
+        yield ([i.strip() for i in ids],
+               np.fromstring("\n".join(rests), sep="\t"))
+
+
+def read_diss(diss_fp, out=None, dtype=np.float64):
+    # Returns the condensed distances (see _matrix) and the sample ids,
+    # filling out (e.g. a numpy.memmap) when given instead of allocating.
+    # Rows of the lower-triangular PHYLIP-style file may or may not include
+    # the diagonal. Row i holds the entries (j, i) for j < i of the condensed
+    # upper triangle, which are scattered in bulk for each chunk of rows.
+    with open(diss_fp, 'r') as dist_file:
+        nsamples = int(dist_file.readline())
+        condensed = _matrix.allocate(nsamples, dtype=dtype) \
+            if out is None else out
+        starts = _matrix.row_starts(nsamples)
+        ids = []
+        for chunk_ids, values in _diss_chunks(dist_file):
+            first, last = len(ids), len(ids) + len(chunk_ids)
+            if last > nsamples:
+                raise ValueError("Malformed distance file: %s" % diss_fp)
+            rows = np.arange(first, last)
+            lower = rows.sum()
+            if values.size == lower + len(chunk_ids):
+                # Drop the diagonal, the last value of every row
+                values = np.delete(values, np.cumsum(rows + 1) - 1)
+            elif values.size != lower:
+                raise ValueError("Malformed distance file: %s" % diss_fp)
+            columns = np.arange(lower) - np.repeat(np.cumsum(rows) - rows,
+                                                   rows)
+            condensed[starts[columns] + np.repeat(rows, rows)] = values
+            ids.extend(chunk_ids)
+    if len(ids) != nsamples:
+        raise ValueError("Malformed distance file: %s" % diss_fp)
+    return condensed, ids
+
+
+def run(work_dir, table_fp, calculator, weighted, newick_fp=None, out=None,
+        dtype=np.float64):
+    # Each run writes output.diss into work_dir, so concurrent or repeated
+    # runs sharing the same table need their own directory.
+    cmd = 'ExpressBetaDiversity'
+    if newick_fp is not None:
+        cmd += ' -t %s' % shlex.quote(newick_fp)
+    cmd += ' -s %s' % shlex.quote(table_fp)
+    if weighted:
+        cmd += ' -w'
+    cmd += ' -c %s' % calculator
+    subprocess.run(cmd, cwd=work_dir, shell=True)
+    return read_diss(os.path.join(work_dir, 'output.diss'), out, dtype)
@@ -0,0 +1,104 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# Storage for the distance matrices being assembled. Matrices are kept in
+# condensed form, the upper triangle in row-major order as used by
+# scipy.spatial.distance.squareform, in the requested precision. Without a
+# directory the matrix lives in RAM; with one it is a disk-backed
+# numpy.memmap that tiles and EBD output are written into directly, so the
+# full matrix never has to be held in memory.
+
+import os
+import tempfile
+
+import numpy as np
+import scipy.spatial.distance
+import skbio
+
+
+def condensed_size(n_samples):
+    return n_samples * (n_samples - 1) // 2
+
+
+def row_starts(n_samples):
+    # Position of the (virtual) diagonal entry (i, i) in the condensed
+    # vector, so that (i, j) with i < j lives at row_starts[i] + j.
+    i = np.arange(n_samples, dtype=np.int64)
+    return i * n_samples - i * (i + 1) // 2 - i - 1
+
+
+def allocate(n_samples, directory=None, dtype=np.float64):
+    size = condensed_size(n_samples)
+    if directory is None or not size:
+        return np.zeros(size, dtype=dtype)
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, prefix='q2-ebd-',
+                                suffix='.dist')
+    os.close(fd)
+    return np.memmap(path, dtype=dtype, mode='w+', shape=(size,))
+
+
+def release(condensed):
+    # Removes the file behind a disk-backed matrix that has been superseded.
+    # The mapping stays readable until the array is dropped.
+    if isinstance(condensed, np.memmap) and condensed.filename:
+        try:
+            os.remove(condensed.filename)
+        except FileNotFoundError:
+            pass
+
+
+def place(condensed, n_samples, rows, cols, block):
+    # Writes the part of the block of (rows, cols) slices that lies above
+    # the diagonal, one contiguous run of the condensed vector per row.
+    starts = row_starts(n_samples)
+    for offset, i in enumerate(range(rows.start, rows.stop)):
+        first = max(cols.start, i + 1)
+        if first >= cols.stop:
+            continue
+        condensed[starts[i] + first:starts[i] + cols.stop] = \
+            block[offset, first - cols.start:]
+
+
+def embed(condensed, n_samples, sub, n_sub):
+    # Copies the condensed matrix sub of the first n_sub samples into place
+    starts, sub_starts = row_starts(n_samples), row_starts(n_sub)
+    for i in range(n_sub - 1):
+        condensed[starts[i] + i + 1:starts[i] + n_sub] = \
+            sub[sub_starts[i] + i + 1:sub_starts[i] + n_sub]
+
+
+def block(condensed, n_samples, rows, cols):
+    # Square-form values for the rows and cols index arrays. Diagonal
+    # entries have no place in the condensed vector and are left at zero.
+    rows, cols = np.ix_(np.asarray(rows, dtype=np.int64),
+                        np.asarray(cols, dtype=np.int64))
+    low, high = np.minimum(rows, cols), np.maximum(rows, cols)
+    values = np.zeros(low.shape, dtype=condensed.dtype)
+    off = low != high
+    values[off] = condensed[row_starts(n_samples)[low[off]] + high[off]]
+    return values
+
+
+def reorder(condensed, n_samples, order, directory=None, band=1024):
+    # The condensed matrix of the samples taken in order, assembled a band of
+    # rows at a time. The caller releases condensed once it is done with it.
+    out = allocate(n_samples, directory, condensed.dtype)
+    for start in range(0, n_samples, band):
+        rows = slice(start, min(start + band, n_samples))
+        place(out, n_samples, rows, slice(0, n_samples),
+              block(condensed, n_samples, order[rows], order))
+    return out
+
+
+def distance_matrix(condensed, ids):
+    # Handed over in square form: scikit-bio releases with condensed storage
+    # cannot write condensed matrices to the lsmat files QIIME stores them
+    # in. The square matrix keeps the precision of the condensed one.
+    return skbio.DistanceMatrix(
+        scipy.spatial.distance.squareform(condensed, checks=False), ids)
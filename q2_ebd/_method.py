@@ -7,22 +7,29 @@
 # ----------------------------------------------------------------------------
 
 
+import collections
 import tempfile
 import os
-import subprocess
+import shutil
 import sys
+import threading
 import pkg_resources
 
-import holoviews as hv
-hv.extension("bokeh")
-from bokeh.io import save
-
 import biom
 import skbio
 import numpy as np
+import pandas as pd
+import scipy.sparse
+import scipy.sparse.csgraph
+import qiime2
 import q2templates
+import yaml
 
 from q2_types.distance_matrix import DistanceMatrixDirectoryFormat
+from q2_types.ordination import OrdinationDirectoryFormat
+
+from q2_ebd import (_cache, _ebd, _matrix, _native, _ordination,
+                    _parallel, _scatter, _sparse, _tree)
 
 TEMPLATES = pkg_resources.resource_filename('q2_ebd', 'assets')
 
@@ -46,180 +53,961 @@ def non_phylogenetic_metrics():
 def all_metrics():
     return phylogenetic_metrics() | non_phylogenetic_metrics()
 
-def plot(output_dir: str, distance_matrix: DistanceMatrixDirectoryFormat)-> None:
-    measures = []
-    n_measures = len(distance_matrix)
-    n_samples = None
-    i = 0
-    scatter_dict = {}
-    scatter_opts = dict(height=500, width=500, tools=['hover', 'box_select'], 
-                        framewise=True, axiswise=True, size=5)
-    for matrix in distance_matrix:
-        action_f = open(str(matrix)+"/../provenance/action/action.yaml",'r')
-        while (action_f.readline() != "    parameters:\n"):
-            pass
-        param = action_f.readline()
-        md = {}
-        while "    -" in param:
-            key, val = param.strip()[1:].strip().split(":")
-            val = val.strip()
-            md[key] = val
-            param = action_f.readline()
-        measure = md['metric'] + ", " + md['weighted']
-        measures.append(measure)
-        dm = matrix.file.view(skbio.DistanceMatrix)
-        coords = skbio.stats.ordination.pcoa(dm)
-        if n_samples is None:
-            n_samples = dm.shape[1]
+def engines():
+    return {'ebd', 'native', 'sparse'}
+
+def precisions():
+    return {'float64', 'float32'}
+
+PHYLOGENETIC_NAME_MAP = {'braycurtis': 'Bray-Curtis',
+                         'sorensen': 'Bray-Curtis',
+                         'canberra': 'Canberra',
+                         'chi_squared': 'Chi-squared',
+                         'coeff_similarity': 'CS',
+                         'complete_tree': 'CT',
+                         'euclidean': 'Euclidean',
+                         'f_st': 'Fst',
+                         'p_st': 'Fst',
+                         'gower': 'Gower',
+                         'hellinger': 'Hellinger',
+                         'kulczynski': 'Kulczynski',
+                         'lennon': 'Lennon',
+                         'manhattan': 'Manhattan',
+                         'weighted_unifrac': 'Manhattan',
+                         'mnnd': 'MNND',
+                         'mpd': 'MPD',
+                         'morisita_horn': 'Morisita-Horn',
+                         'normalized_weighted_unifrac': 'NWU',
+                         'pearson': 'Pearson',
+                         'raohp': 'RaoHp',
+                         'soergel': 'Soergel',
+                         'jaccard': 'Soergel',
+                         'unweighted_unifrac': 'Soergel',
+                         'ruzicka': 'Soergel',
+                         'tamas_coeff': 'TC',
+                         'weighted_corr': 'WC',
+                         'whittaker': 'Whittaker',
+                         'yue_clayton': 'Yue-Clayton'
+                        }
+
+NAME_MAP = {'braycurtis': 'Bray-Curtis',
+            'sorensen': 'Bray-Curtis',
+            'canberra': 'Canberra',
+            'chi_squared': 'Chi-squared',
+            'coeff_similarity': 'CS',
+            'euclidean': 'Euclidean',
+            'f_st': 'Fst',
+            'gower': 'Gower',
+            'hellinger': 'Hellinger',
+            'kulczynski': 'Kulczynski',
+            'lennon': 'Lennon',
+            'manhattan': 'Manhattan',
+            'morisita_horn': 'Morisita-Horn',
+            'pearson': 'Pearson',
+            'raohp': 'RaoHp',
+            'soergel': 'Soergel',
+            'jaccard': 'Soergel',
+            'ruzicka': 'Soergel',
+            'tamas_coeff': 'TC',
+            'weighted_corr': 'WC',
+            'whittaker': 'Whittaker',
+            'yue_clayton': 'Yue-Clayton'
+           }
+
+
+class _ProvenanceLoader(yaml.SafeLoader):
+    # Provenance tags some values (!ref, !set, !metadata, ...), which are
+    # read as the plain values they tag
+    pass
+
+
+def _untagged(loader, suffix, node):
+    if isinstance(node, yaml.MappingNode):
+        return loader.construct_mapping(node, deep=True)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_scalar(node)
+
+
+_ProvenanceLoader.add_multi_constructor('!', _untagged)
+
+
+def _action(action_fp):
+    # The action section of an action.yaml, empty for e.g. imports
+    with open(action_fp, 'r') as action_f:
+        document = yaml.load(action_f, Loader=_ProvenanceLoader) or {}
+    action = document.get('action')
+    return action if isinstance(action, dict) else {}
+
+
+def _action_parameters(action):
+    # Parameters are recorded as a list of single-entry mappings
+    md = {}
+    for param in action.get('parameters') or []:
+        if isinstance(param, dict):
+            md.update(param)
+    return md
+
+
+def _label(action):
+    # Members of a collection output are labelled by their key, anything
+    # else by the metric and weighting the action computed, if it computed
+    # a single one
+    output_name = action.get('output-name')
+    if isinstance(output_name, list) and len(output_name) > 1:
+        return str(output_name[1])
+    md = _action_parameters(action)
+    if 'metrics' in md:
+        metrics = list(md['metrics'] or [])
+        weightings = [w for w, wanted in ((True, md.get('weighted', True)),
+                                          (False, md.get('unweighted', True)))
+                      if wanted]
+    elif 'metric' in md:
+        metrics = [md['metric']]
+        if 'weighted' not in md:
+            return str(md['metric'])
+        weightings = [md['weighted']]
+    else:
+        return None
+    if len(metrics) == 1 and len(weightings) == 1:
+        return _collection_key(metrics[0], weightings[0])
+    return None
+
+
+def _artifact_uuid(artifact):
+    with open(str(artifact)+"/../metadata.yaml",'r') as metadata_f:
+        for line in metadata_f:
+            if line.startswith("uuid:"):
+                return line.split(":", 1)[1].strip()
+    return None
+
+
+def _uuids(value):
+    # The artifact UUIDs of an input, which may be a collection of them
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [uuid for item in value for uuid in _uuids(item)]
+    return [] if value is None else [str(value)]
+
+
+def _measure(artifact):
+    # The measure recorded in the provenance of the artifact or, for e.g. a
+    # PCoA, in that of the artifacts it was computed from. Those are
+    # searched breadth-first through the inputs of every action, in the
+    # order they were recorded, stopping at the action that computed the
+    # distances.
+    provenance = str(artifact)+"/../provenance"
+    queue = collections.deque([os.path.join(provenance, 'action')])
+    seen = set()
+    while queue:
+        action_dir = queue.popleft()
+        action_fp = os.path.join(action_dir, 'action.yaml')
+        if action_dir in seen or not os.path.exists(action_fp):
+            continue
+        seen.add(action_dir)
+        action = _action(action_fp)
+        label = _label(action)
+        if label is not None:
+            return label
+        md = _action_parameters(action)
+        if 'metric' in md or 'metrics' in md:
+            break
+        for entry in action.get('inputs') or []:
+            for uuid in _uuids(entry):
+                queue.append(os.path.join(provenance, 'artifacts', uuid,
+                                          'action'))
+    return _artifact_uuid(artifact)
+
+
+def _ordinate(matrix, dimensions, cache=None):
+    # Ordinations of an artifact are cached by its UUID, so that replotting
+    # the same matrices does not load them or solve for their axes again.
+    key = None
+    if cache is not None:
+        uuid = _artifact_uuid(matrix)
+        if uuid is not None:
+            key = '%s-pcoa-%d' % (uuid, dimensions)
+            cached = cache.get(key)
+            if cached is not None:
+                return _measure(matrix), _ordination.ordination_results(
+                    [str(i) for i in cached['ids']], cached['coordinates'],
+                    cached['eigvals'], cached['proportions'], 'PCoA',
+                    'Principal Coordinate Analysis')
+    dm = matrix.file.view(skbio.DistanceMatrix)
+    coords = _ordination.pcoa(dm, dimensions)
+    if key is not None:
+        cache.put(key, coords)
+    return _measure(matrix), coords
+
+
+def _load_ordination(ordination):
+    return _measure(ordination), ordination.file.view(skbio.OrdinationResults)
+
+
+def plot(output_dir: str,
+         distance_matrix: DistanceMatrixDirectoryFormat = None,
+         pcoa: OrdinationDirectoryFormat = None, dimensions: int = 2,
+         n_jobs: int = 1, cache_dir: str = None, cache_size: int = 1024,
+         lazy: bool = False, metadata: qiime2.Metadata = None)-> None:
+    # Matrices are loaded and ordinated by up to n_jobs workers, the plot is
+    # assembled once all of them are done. Precomputed PCoA results are
+    # plotted as they are. All measures share the sample ids and metadata
+    # of the page. A lazy plot fetches the coordinates of a measure from a
+    # sidecar file when it is selected instead of embedding them all.
+    if not distance_matrix and not pcoa:
+        raise ValueError("Provide distance matrices or PCoA results to plot")
+    cache = None
+    if cache_dir is not None:
+        cache = _cache.OrdinationCache(cache_dir, cache_size * 2 ** 20)
+    frames = {}
+    ordinations = _parallel.map_jobs(
+        lambda matrix: _ordinate(matrix, dimensions, cache),
+        distance_matrix or [], n_jobs)
+    ordinations += _parallel.map_jobs(_load_ordination, pcoa or [], n_jobs)
+    samples = None
+    for measure, coords in ordinations:
+        if samples is None:
             samples = coords.samples.index
         assert (coords.samples.index == samples).all(), "sample order mismatch, are these all from the same analysis?"
-        scatter_dict[measure] = hv.Points(coords.samples[['PC1','PC2']]).options(**scatter_opts) # This is where we'd add in colour
-        i += 1
-    ds = hv.HoloMap(scatter_dict, kdims=['measure'])
-    renderer = hv.renderer('bokeh')
-    renderer.save(ds, output_dir + '/ebd')
-#    plot = renderer.get_plot(ds).state
-#    save(plot, output_dir + '/ebd.html')
+        # Axes read back from files are numbered rather than named
+        points = coords.samples.iloc[:, :2].set_axis(['PC1', 'PC2'], axis=1)
+        label, n = measure, 1
+        while label in frames:
+            n += 1
+            label = '%s (%d)' % (measure, n)
+        frames[label] = points
+    save = _scatter.save_lazy if lazy else _scatter.save_embedded
+    save(output_dir, samples,
+         [(measure, points.values) for measure, points in frames.items()],
+         metadata)
     index = os.path.join(TEMPLATES, 'index.html')
     q2templates.render(index, output_dir, context={})
 
+
+def resolve_metric(metric, weighted, phylogenetic):
+    # Several public metric names run the same EBD calculator, e.g. jaccard,
+    # ruzicka, soergel and unweighted_unifrac all run Soergel. Requests that
+    # resolve to the same key produce the same distance matrix.
+    name_map = PHYLOGENETIC_NAME_MAP if phylogenetic else NAME_MAP
+    return name_map[metric], bool(weighted)
+
+
+# Calculators whose distances cannot change when features, or branches,
+# without counts in any sample are dropped and chains of single-child nodes
+# are merged into one branch: every feature or branch contributes through
+# sums weighted by its length, in which an all-zero column adds nothing.
+# The correlations centre profiles over every column and the tree-based
+# EBD calculators look at the whole tree, so they are only pruned on request.
+PRUNE_INVARIANT = {'Bray-Curtis', 'Canberra', 'Chi-squared', 'CS',
+                   'Euclidean', 'Fst', 'Gower', 'Hellinger', 'Kulczynski',
+                   'Lennon', 'Manhattan', 'Morisita-Horn', 'NWU', 'RaoHp',
+                   'Soergel', 'TC', 'Whittaker', 'Yue-Clayton'}
+
+
+def _prunes(prune, jobs):
+    # By default, pruning only applies when it cannot change any result
+    if prune is None:
+        return all(calculator in PRUNE_INVARIANT for calculator, _ in jobs)
+    return prune
+
+
+def _preprocess(table, tree):
+    # Drops features without counts in any sample and shears the tree down to
+    # the remaining features, so no work is spent on dead branches.
+    table = table.remove_empty(axis='observation', inplace=False)
+    if tree is not None:
+        tree = tree.prune(table.ids(axis='observation'))
+    return table, tree
+
+
+def _distances(table, phylogeny, jobs, engine, cache_dir=None,
+               cache_size=1024, n_jobs=1, block_size=None, memmap_dir=None,
+               prune=None, precision='float64'):
+    # Computes one distance matrix per (calculator, weighted) job, computing
+    # jobs that resolve to the same key only once and, if a cache directory
+    # is given, only when no earlier run stored them. The phylogeny is
+    # converted to a CompactTree once and only that is used from here on.
+    # Results stay condensed, in the requested precision, until they are
+    # handed over as DistanceMatrix objects.
+    tree = None
+    if phylogeny is not None:
+        tree = _tree.CompactTree.from_treenode(phylogeny)
+    if _prunes(prune, jobs):
+        table, tree = _preprocess(table, tree)
+    sample_ids = table.ids(axis='sample')
+    unique_jobs = list(dict.fromkeys(jobs))
+    results = {}
+    if cache_dir is not None:
+        cache = _cache.DistanceMatrixCache(cache_dir, cache_size * 2 ** 20)
+        hashes = (_cache.table_digest(table), _cache.tree_digest(tree))
+        engine_hash = _cache.engine_digest(engine)
+        keys = {job: _cache.cache_key(*hashes, *job, engine_hash, precision)
+                for job in unique_jobs}
+        for job in unique_jobs:
+            cached = cache.get(keys[job])
+            if cached is not None:
+                results[job] = cached
+    missing = [job for job in unique_jobs if job not in results]
+    if missing:
+        newick_dir = None
+        if cache_dir is not None:
+            newick_dir = os.path.join(cache_dir, 'trees')
+        computed = _compute(table, tree, missing, engine, n_jobs,
+                            block_size, memmap_dir, newick_dir, precision)
+        results.update(zip(missing, computed))
+        if cache_dir is not None:
+            for job, dists in zip(missing, computed):
+                cache.put(keys[job], dists, sample_ids)
+    seen = set()
+    distance_matrices = []
+    for job in jobs:
+        dists = results[job] if job not in seen else results[job].copy()
+        distance_matrices.append(_matrix.distance_matrix(dists, sample_ids))
+        seen.add(job)
+    return distance_matrices
+
+
+def _blocks(start, stop, block_size=None):
+    # Splits the samples start..stop into consecutive blocks
+    if not block_size or block_size >= stop - start:
+        return [slice(start, stop)]
+    return [slice(first, min(first + block_size, stop))
+            for first in range(start, stop, block_size)]
+
+
+def _tiles(n_samples, block_size=None):
+    # Lists every block pair of the upper triangle, diagonal blocks included.
+    blocks = _blocks(0, n_samples, block_size)
+    return [(rows, cols) for i, rows in enumerate(blocks)
+            for cols in blocks[i:]]
+
+
+def _bands(n_samples, band_size):
+    # Bands of rows against every later sample, for the engines that compute
+    # rectangles directly
+    return [(rows, slice(rows.start, n_samples))
+            for rows in _blocks(0, n_samples, band_size)]
+
+
+def _extension_tiles(n_old, n_samples, block_size=None):
+    # The tiles that involve samples n_old..n_samples: every old block
+    # against every new block, and the upper triangle of the new blocks.
+    new = _blocks(n_old, n_samples, block_size)
+    tiles = [(rows, cols) for rows in _blocks(0, n_old, block_size)
+             for cols in new]
+    return tiles + [(rows, cols) for i, rows in enumerate(new)
+                    for cols in new[i:]]
+
+
+def _compute(table, tree, jobs, engine, n_jobs=1, block_size=None,
+             memmap_dir=None, newick_dir=None, precision='float64',
+             tiles=None, sink=None):
+    # The table, tree and profiles are prepared once and shared by every job.
+    # With a block size, each job is split into tiles over pairs of sample
+    # blocks. Up to n_jobs tiles run concurrently and write straight into the
+    # job's condensed matrix, which is disk-backed when memmap_dir is given.
+    # Given tiles, only those are computed and the rest is left at zero.
+    # Given a sink, every computed tile is handed to sink(job, rows, cols,
+    # block) instead and nothing is allocated or returned.
+    sample_ids = table.ids(axis='sample')
+    n_samples = len(sample_ids)
+    if tiles is None and engine != 'ebd' and block_size is None:
+        # A single tile would be computed as a float64 square first, so the
+        # condensed matrix is filled a band of rows at a time, each band cast
+        # to the requested precision as it is placed
+        tiles = _bands(n_samples,
+                       max(1, _native.BLOCK_CELLS // max(1, n_samples)))
+    elif tiles is None:
+        tiles = _tiles(n_samples, block_size)
+    # Tasks are ordered by tile, so the calculators of a tile run together
+    # and the ebd engine's file of the tile is only on disk meanwhile
+    tasks = [(job, tile) for tile in range(len(tiles))
+             for job in range(len(jobs))]
+    if sink is None:
+        outputs = [_matrix.allocate(n_samples, memmap_dir, precision)
+                   for _ in jobs]
+
+        def place(job, rows, cols, block):
+            _matrix.place(outputs[job], n_samples, rows, cols, block)
+    else:
+        outputs, place = None, sink
+    if engine != 'ebd':
+        module = _native if engine == 'native' else _sparse
+        lengths = None
+        if tree is not None:
+            incidence, lengths = tree.branch_incidence(
+                table.ids(axis='observation'))
+        profiles = {}
+        for weighted in {weighted for _, weighted in jobs}:
+            profiles[weighted] = module.profiles(table, weighted)
+            if tree is not None:
+                profiles[weighted] = _tree.branch_profiles(
+                    profiles[weighted], incidence, weighted)
+
+        def run_task(task):
+            job, tile = task
+            calculator, weighted = jobs[job]
+            rows, cols = tiles[tile]
+            X = profiles[weighted]
+            place(job, rows, cols,
+                  module.pairwise(X[rows], X[cols], calculator, lengths,
+                                  reference=X))
+        _parallel.map_jobs(run_task, tasks, n_jobs)
+    else:
+        if len(tiles) > 1 and any(calculator == 'Gower'
+                                  for calculator, _ in jobs):
+            raise ValueError("Gower scales by ranges over all samples, so it "
+                             "cannot be tiled with the ebd engine")
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            _run_ebd_tiles(temp_dir_name, table, tree, jobs, tiles, tasks,
+                           outputs, place, n_jobs, newick_dir, memmap_dir)
+
+    return outputs
+
+
+def _run_ebd_tiles(temp_dir_name, table, tree, jobs, tiles, tasks,
+                   outputs, place, n_jobs, newick_dir=None, memmap_dir=None):
+    # Reuse the Newick file of the tree if an earlier call wrote one, then
+    # run each (job, tile) task in its own directory and hand the tile to
+    # place. The samples of a tile are written by the first of its tasks to
+    # start, shared by the others and removed once the last of them is done,
+    # so only the tiles being worked on are on disk.
+    sample_ids = table.ids(axis='sample')
+    n_samples = len(sample_ids)
+    newick_fp = None
+    if tree is not None:
+        newick_fp = _ebd.newick_file(tree, temp_dir_name, newick_dir)
+    locks = [threading.Lock() for _ in tiles]
+    pending = collections.Counter(tile for _, tile in tasks)
+    table_fps = {}
+
+    def acquire_table(tile):
+        with locks[tile]:
+            if tile not in table_fps:
+                rows, cols = tiles[tile]
+                ids = list(sample_ids[rows])
+                if rows != cols:
+                    ids += list(sample_ids[cols])
+                tile_table = table
+                if len(ids) < n_samples:
+                    tile_table = table.filter(ids, axis='sample',
+                                              inplace=False)
+                table_fp = os.path.join(temp_dir_name, 'tile%d.tsv' % tile)
+                _ebd.write_table(tile_table, table_fp)
+                table_fps[tile] = table_fp
+            return table_fps[tile]
+
+    def release_table(tile):
+        with locks[tile]:
+            pending[tile] -= 1
+            if not pending[tile]:
+                os.remove(table_fps.pop(tile))
+
+    def run_task(indexed_task):
+        i, (job, tile) = indexed_task
+        job_dir = os.path.join(temp_dir_name, 'job%d' % i)
+        os.mkdir(job_dir)
+        try:
+            run_tile(job_dir, job, tile, acquire_table(tile))
+        finally:
+            release_table(tile)
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def run_tile(job_dir, job, tile, table_fp):
+        calculator, weighted = jobs[job]
+        rows, cols = tiles[tile]
+        dtype = np.float64 if outputs is None else outputs[job].dtype
+        if len(tiles) == 1 and rows == cols == slice(0, n_samples) \
+                and outputs is not None:
+            # The whole matrix: let the parser fill the output directly
+            dists, ids = _ebd.run(job_dir, table_fp, calculator, weighted,
+                                  newick_fp, out=outputs[job], dtype=dtype)
+            if list(ids) != list(sample_ids):
+                index = {sample_id: position
+                         for position, sample_id in enumerate(ids)}
+                order = np.array([index[s] for s in sample_ids])
+                outputs[job] = _matrix.reorder(dists, n_samples, order,
+                                               memmap_dir)
+                _matrix.release(dists)
+            return
+        dists, ids = _ebd.run(job_dir, table_fp, calculator, weighted,
+                              newick_fp, dtype=dtype)
+        index = {sample_id: position for position, sample_id in enumerate(ids)}
+        place(job, rows, cols,
+              _matrix.block(dists, len(ids),
+                            [index[s] for s in sample_ids[rows]],
+                            [index[s] for s in sample_ids[cols]]))
+    _parallel.map_jobs(run_task, enumerate(tasks), n_jobs)
+
+
+def _weightings(weighted, unweighted):
+    weightings = [w for w, wanted in ((True, weighted), (False, unweighted))
+                  if wanted]
+    if not weightings:
+        raise ValueError("At least one of weighted and unweighted must be "
+                         "requested")
+    return weightings
+
+
+def _collection_key(metric, weighted):
+    return '%s_%s' % (metric, 'weighted' if weighted else 'unweighted')
+
+
 def beta_phylogenetic(table: biom.Table, phylogeny: skbio.TreeNode,
-                      metric: str, weighted: bool)-> skbio.DistanceMatrix:
+                      metric: str, weighted: bool, engine: str = 'ebd',
+                      cache_dir: str = None, cache_size: int = 1024,
+                      block_size: int = None, n_jobs: int = 1,
+                      memmap_dir: str = None,
+                      prune: bool = None,
+                      precision: str = 'float64')-> skbio.DistanceMatrix:
     if metric not in phylogenetic_metrics():
         raise ValueError("Unknown phylogenetic metric: %s" % metric)
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if precision not in precisions():
+        raise ValueError("Unknown precision: %s" % precision)
     if table.is_empty():
         raise ValueError("The provided table object is empty")
 
-    # Write table to temp file
-    with tempfile.TemporaryDirectory() as temp_dir_name:
-        table_fp = os.path.join(temp_dir_name, 'otu_table.tsv')
-        newick_fp = os.path.join(temp_dir_name, 'tree.newick')
-        with open(table_fp, 'w') as out_table, open(newick_fp, 'w') as newick:
-            # This is easy, just write to newick
-            phylogeny.write(newick)
-            # We have to iterate through each sample
-            out_table.write("\t" + "\t".join(table.ids(axis='observation')))
-            for sample_id in table.ids(axis='sample'):
-                row = table.data(sample_id)
-                out_table.write("\n" + str(sample_id) + "\t" + \
-                        "\t".join([str(x) for x in row]))
-    # Run ExpressBetaDiversity on them
-        name_map = {'braycurtis': 'Bray-Curtis',
-                    'sorensen': 'Bray-Curtis',
-                    'canberra': 'Canberra',
-                    'chi_squared': 'Chi-squared',
-                    'coeff_similarity': 'CS',
-                    'complete_tree': 'CT',
-                    'euclidean': 'Euclidean',
-                    'f_st': 'Fst',
-                    'p_st': 'Fst',
-                    'gower': 'Gower',
-                    'hellinger': 'Hellinger',
-                    'kulczynski': 'Kulczynski',
-                    'lennon': 'Lennon',
-                    'manhattan': 'Manhattan',
-                    'weighted_unifrac': 'Manhattan',
-                    'mnnd': 'MNND',
-                    'mpd': 'MPD',
-                    'morisita_horn': 'Morisita-Horn',
-                    'normalized_weighted_unifrac': 'NWU',
-                    'pearson': 'Pearson',
-                    'raohp': 'RaoHp',
-                    'soergel': 'Soergel',
-                    'jaccard': 'Soergel',
-                    'unweighted_unifrac': 'Soergel',
-                    'ruzicka': 'Soergel',
-                    'tamas_coeff': 'TC',
-                    'weighted_corr': 'WC',
-                    'whittaker': 'Whittaker',
-                    'yue_clayton': 'Yue-Clayton'
-                   }
-        if weighted:
-            weighted = "-w"
-        else:
-            weighted = ""
-        cmd = 'ExpressBetaDiversity -t tree.newick -s otu_table.tsv %s -c %s' \
-                                                  % (weighted, name_map[metric])
-        subprocess.run(cmd, cwd=temp_dir_name, shell=True)
-        with open(os.path.join(temp_dir_name, 'output.diss'), 'r') as dist_file:
-            nsamples = int(dist_file.readline())
-            dist_mat = np.zeros((nsamples, nsamples))
-            ids = []
-            for i, line in enumerate(dist_file):
-                ids.append(line.split("\t")[0].strip())
-                for j, dist in enumerate(line.split("\t")[1:]):
-                    dist_mat[i,j] = float(dist)
-                    dist_mat[j,i] = float(dist)
-
-    # Suck the data matrix back in
-    # Return a DistanceMatrix object
-    results = skbio.DistanceMatrix(dist_mat, ids)
-    return results
-
-
-
-def beta(table: biom.Table, metric: str, weighted: bool)-> skbio.DistanceMatrix:
+    jobs = [resolve_metric(metric, weighted, phylogenetic=True)]
+    return _distances(table, phylogeny, jobs, engine, cache_dir, cache_size,
+                      n_jobs, block_size, memmap_dir, prune, precision)[0]
+
+
+def beta(table: biom.Table, metric: str, weighted: bool, engine: str = 'ebd',
+         cache_dir: str = None, cache_size: int = 1024, block_size: int = None,
+         n_jobs: int = 1, memmap_dir: str = None,
+         prune: bool = None,
+         precision: str = 'float64')-> skbio.DistanceMatrix:
     if metric not in non_phylogenetic_metrics():
         raise ValueError("Unknown metric: %s" % metric)
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if precision not in precisions():
+        raise ValueError("Unknown precision: %s" % precision)
+    if table.is_empty():
+        raise ValueError("The provided table object is empty")
+
+    jobs = [resolve_metric(metric, weighted, phylogenetic=False)]
+    return _distances(table, None, jobs, engine, cache_dir, cache_size,
+                      n_jobs, block_size, memmap_dir, prune, precision)[0]
+
+
+def beta_phylogenetic_many(table: biom.Table, phylogeny: skbio.TreeNode,
+                           metrics: set, weighted: bool = True,
+                           unweighted: bool = True, engine: str = 'ebd',
+                           cache_dir: str = None, cache_size: int = 1024,
+                           block_size: int = None, n_jobs: int = 1,
+                           memmap_dir: str = None,
+                           prune: bool = None,
+                           precision: str = 'float64')-> skbio.DistanceMatrix:
+    unknown = set(metrics) - phylogenetic_metrics()
+    if unknown:
+        raise ValueError("Unknown phylogenetic metrics: %s"
+                         % ", ".join(sorted(unknown)))
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if precision not in precisions():
+        raise ValueError("Unknown precision: %s" % precision)
+    if table.is_empty():
+        raise ValueError("The provided table object is empty")
+
+    keys, jobs = [], []
+    for metric in sorted(metrics):
+        for w in _weightings(weighted, unweighted):
+            keys.append(_collection_key(metric, w))
+            jobs.append(resolve_metric(metric, w, phylogenetic=True))
+    return dict(zip(keys, _distances(table, phylogeny, jobs, engine,
+                                     cache_dir, cache_size, n_jobs,
+                                     block_size, memmap_dir, prune,
+                                     precision)))
+
+
+def beta_many(table: biom.Table, metrics: set, weighted: bool = True,
+              unweighted: bool = True, engine: str = 'ebd',
+              cache_dir: str = None, cache_size: int = 1024,
+              block_size: int = None, n_jobs: int = 1,
+              memmap_dir: str = None,
+              prune: bool = None,
+              precision: str = 'float64')-> skbio.DistanceMatrix:
+    unknown = set(metrics) - non_phylogenetic_metrics()
+    if unknown:
+        raise ValueError("Unknown metrics: %s" % ", ".join(sorted(unknown)))
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if precision not in precisions():
+        raise ValueError("Unknown precision: %s" % precision)
+    if table.is_empty():
+        raise ValueError("The provided table object is empty")
+
+    keys, jobs = [], []
+    for metric in sorted(metrics):
+        for w in _weightings(weighted, unweighted):
+            keys.append(_collection_key(metric, w))
+            jobs.append(resolve_metric(metric, w, phylogenetic=False))
+    return dict(zip(keys, _distances(table, None, jobs, engine, cache_dir,
+                                     cache_size, n_jobs, block_size,
+                                     memmap_dir, prune, precision)))
+
+
+def beta_stratified(table: biom.Table, metric: str, weighted: bool,
+                    group_column: qiime2.CategoricalMetadataColumn,
+                    phylogeny: skbio.TreeNode = None, engine: str = 'ebd',
+                    cache_dir: str = None, cache_size: int = 1024,
+                    block_size: int = None, n_jobs: int = 1,
+                    memmap_dir: str = None, prune: bool = None,
+                    precision: str = 'float64')-> skbio.DistanceMatrix:
+    # One distance matrix per group of the column, over the samples of the
+    # table in that group. Samples without a group are left out. Up to
+    # n_jobs groups are computed concurrently, each of them in one job.
+    phylogenetic = phylogeny is not None
+    if metric not in (phylogenetic_metrics() if phylogenetic
+                      else non_phylogenetic_metrics()):
+        raise ValueError("Unknown %smetric: %s"
+                         % ('phylogenetic ' if phylogenetic else '', metric))
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if precision not in precisions():
+        raise ValueError("Unknown precision: %s" % precision)
+    if table.is_empty():
+        raise ValueError("The provided table object is empty")
+
+    groups = group_column.to_series().dropna()
+    groups = groups[groups.index.isin(table.ids(axis='sample'))]
+    if groups.empty:
+        raise ValueError("No sample of the table has a %s"
+                         % group_column.name)
+    jobs = [resolve_metric(metric, weighted, phylogenetic)]
+    members = [(str(group), list(ids))
+               for group, ids in groups.groupby(groups).groups.items()]
+
+    def run_group(member):
+        group, ids = member
+        return _distances(table.filter(ids, axis='sample', inplace=False),
+                          phylogeny, jobs, engine, cache_dir, cache_size, 1,
+                          block_size, memmap_dir, prune, precision)[0]
+    return dict(zip([group for group, _ in members],
+                    _parallel.map_jobs(run_group, members, n_jobs)))
+
+
+def extend(distance_matrix: skbio.DistanceMatrix, table: biom.Table,
+           metric: str, weighted: bool, phylogeny: skbio.TreeNode = None,
+           engine: str = 'ebd', block_size: int = None, n_jobs: int = 1,
+           memmap_dir: str = None, prune: bool = None,
+           precision: str = 'float64')-> skbio.DistanceMatrix:
+    # The samples of the table that are not in distance_matrix are appended
+    # to it. Only their distances to the old samples and to each other are
+    # computed, so the settings must be the ones distance_matrix was built
+    # with.
+    phylogenetic = phylogeny is not None
+    if metric not in (phylogenetic_metrics() if phylogenetic
+                      else non_phylogenetic_metrics()):
+        raise ValueError("Unknown %smetric: %s"
+                         % ('phylogenetic ' if phylogenetic else '', metric))
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if precision not in precisions():
+        raise ValueError("Unknown precision: %s" % precision)
+    if table.is_empty():
+        raise ValueError("The provided table object is empty")
+    job = resolve_metric(metric, weighted, phylogenetic)
+    if job[0] == 'Gower':
+        raise ValueError("Gower scales by ranges over all samples, so adding "
+                         "samples changes the existing distances")
+
+    old_ids = list(distance_matrix.ids)
+    sample_ids = set(table.ids(axis='sample'))
+    missing = [s for s in old_ids if s not in sample_ids]
+    if missing:
+        raise ValueError("Sample %s of the distance matrix is not in the "
+                         "table" % missing[0])
+    old = set(old_ids)
+    new_ids = [s for s in table.ids(axis='sample') if s not in old]
+    if not new_ids:
+        return distance_matrix
+    table = table.sort_order(old_ids + new_ids, axis='sample')
+    tree = None
+    if phylogenetic:
+        tree = _tree.CompactTree.from_treenode(phylogeny)
+    if _prunes(prune, [job]):
+        table, tree = _preprocess(table, tree)
+
+    # ExpressBetaDiversity only computes square matrices, so every old block
+    # is run together with a new block. Blocks as large as the new samples
+    # keep that at about four times the rectangle's cost.
+    if engine == 'ebd' and block_size is None:
+        block_size = len(new_ids)
+    n_old, n_samples = len(old_ids), len(old_ids) + len(new_ids)
+    dists = _compute(table, tree, [job], engine, n_jobs, block_size,
+                     memmap_dir, precision=precision,
+                     tiles=_extension_tiles(n_old, n_samples, block_size))[0]
+    _matrix.embed(dists, n_samples, distance_matrix.condensed_form(), n_old)
+    return _matrix.distance_matrix(dists, old_ids + new_ids)
+
+
+def query(query_table: biom.Table, reference_table: biom.Table, metric: str,
+          weighted: bool, phylogeny: skbio.TreeNode = None,
+          engine: str = 'ebd', block_size: int = None, n_jobs: int = 1,
+          prune: bool = None)-> qiime2.Metadata:
+    # Distances from every query sample (rows) to every reference sample
+    # (columns), without the query-by-query and reference-by-reference parts
+    # of the square matrix.
+    phylogenetic = phylogeny is not None
+    if metric not in all_metrics():
+        raise ValueError("Unknown metric: %s" % metric)
+    if metric not in (phylogenetic_metrics() if phylogenetic
+                      else non_phylogenetic_metrics()):
+        raise ValueError("The %s metric %s a phylogeny"
+                         % (metric, 'does not take' if phylogenetic
+                            else 'requires'))
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if query_table.is_empty() or reference_table.is_empty():
+        raise ValueError("The provided table object is empty")
+    query_ids = list(query_table.ids(axis='sample'))
+    reference_ids = list(reference_table.ids(axis='sample'))
+    shared = set(query_ids) & set(reference_ids)
+    if shared:
+        raise ValueError("Sample %s is both a query and a reference sample"
+                         % sorted(shared)[0])
+    job = resolve_metric(metric, weighted, phylogenetic)
+    table = reference_table.merge(query_table)
+    table = table.sort_order(query_ids + reference_ids, axis='sample')
+    tree = None
+    if phylogenetic:
+        tree = _tree.CompactTree.from_treenode(phylogeny)
+    if _prunes(prune, [job]):
+        table, tree = _preprocess(table, tree)
+
+    # As in extend, ExpressBetaDiversity runs each block of references
+    # together with the queries.
+    n_query, n_samples = len(query_ids), len(query_ids) + len(reference_ids)
+    if engine == 'ebd' and block_size is None:
+        block_size = n_query
+    tiles = [(rows, cols) for rows in _blocks(0, n_query, block_size)
+             for cols in _blocks(n_query, n_samples, block_size)]
+    dists = np.zeros((n_query, len(reference_ids)))
+
+    def sink(job, rows, cols, block):
+        dists[rows, cols.start - n_query:cols.stop - n_query] = block
+    _compute(table, tree, [job], engine, n_jobs, block_size, tiles=tiles,
+             sink=sink)
+    return qiime2.Metadata(pd.DataFrame(
+        dists, index=pd.Index(query_ids, name='sample-id'),
+        columns=reference_ids))
+
+
+def _consecutive_pairs(metadata, subject_column, time_column, sample_ids):
+    # Pairs of consecutive time points of the same subject, among the samples
+    # of the table
+    df = metadata.to_dataframe()
+    for column in (subject_column, time_column):
+        if column not in df.columns:
+            raise ValueError("Column %s is not in the metadata" % column)
+    df = df[df.index.isin(sample_ids)][[subject_column, time_column]].dropna()
+    df = df.sort_values([subject_column, time_column])
+    subjects, times = df[subject_column], df[time_column]
+    same = (subjects.values[1:] == subjects.values[:-1])
+    return pd.DataFrame({'sample_a': df.index[:-1][same],
+                         'sample_b': df.index[1:][same],
+                         subject_column: subjects.values[1:][same],
+                         time_column + '_a': times.values[:-1][same],
+                         time_column + '_b': times.values[1:][same]},
+                        index=pd.Index([str(i) for i in range(1, same.sum()
+                                                              + 1)],
+                                       name='id'))
+
+
+def _pair_ids(column, sample_ids):
+    # Metadata reads a column of numeric-looking sample ids as numbers, e.g.
+    # 1001 as 1001.0, so numbers are mapped back to the ids of the table
+    # they stand for
+    if not pd.api.types.is_numeric_dtype(column):
+        return column.astype(str)
+    numeric = {}
+    for sample_id in sample_ids:
+        try:
+            numeric.setdefault(float(sample_id), []).append(sample_id)
+        except ValueError:
+            pass
+    ids = []
+    for value in column:
+        matches = numeric.get(value, [])
+        if len(matches) > 1:
+            raise ValueError("Sample %s of the pairs matches several samples "
+                             "of the table: %s" % (value, ", ".join(matches)))
+        ids.append(matches[0] if matches else str(value))
+    return pd.Series(ids, index=column.index, name=column.name)
+
+
+def beta_pairs(table: biom.Table, metric: str, weighted: bool,
+               phylogeny: skbio.TreeNode = None,
+               pairs: qiime2.Metadata = None,
+               metadata: qiime2.Metadata = None, subject_column: str = None,
+               time_column: str = None, engine: str = 'ebd',
+               block_size: int = None, n_jobs: int = 1,
+               prune: bool = None)-> qiime2.Metadata:
+    # Only the requested pairs are evaluated. Samples are grouped into the
+    # connected components of the pairs, and each component is computed as
+    # one small square matrix; with a block size, consecutive components are
+    # packed together up to that many samples, so the ebd engine is not
+    # started once per component.
+    phylogenetic = phylogeny is not None
+    if metric not in (phylogenetic_metrics() if phylogenetic
+                      else non_phylogenetic_metrics()):
+        raise ValueError("Unknown %smetric: %s"
+                         % ('phylogenetic ' if phylogenetic else '', metric))
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
+    if table.is_empty():
+        raise ValueError("The provided table object is empty")
+    sample_ids = table.ids(axis='sample')
+    if pairs is not None:
+        if metadata is not None or subject_column or time_column:
+            raise ValueError("Provide either pairs or metadata with subject "
+                             "and time columns, not both")
+        requested = pairs.to_dataframe()
+        for column in ('sample_a', 'sample_b'):
+            if column not in requested.columns:
+                raise ValueError("The pairs must have a %s column" % column)
+        requested = requested[['sample_a', 'sample_b']].apply(
+            _pair_ids, sample_ids=sample_ids)
+        missing = set(requested.values.ravel()) - set(sample_ids)
+        if missing:
+            raise ValueError("Sample %s of the pairs is not in the table"
+                             % sorted(missing)[0])
+    elif metadata is not None and subject_column and time_column:
+        requested = _consecutive_pairs(metadata, subject_column, time_column,
+                                       sample_ids)
+    else:
+        raise ValueError("Provide either pairs or metadata with subject and "
+                         "time columns")
+    job = resolve_metric(metric, weighted, phylogenetic)
+
+    distances = np.full(len(requested), np.nan)
+    involved = pd.unique(requested[['sample_a', 'sample_b']].values.ravel())
+    if len(involved):
+        index = {sample_id: i for i, sample_id in enumerate(involved)}
+        a = np.array([index[s] for s in requested['sample_a']])
+        b = np.array([index[s] for s in requested['sample_b']])
+        n_components, labels = scipy.sparse.csgraph.connected_components(
+            scipy.sparse.coo_matrix((np.ones(len(a)), (a, b)),
+                                    shape=(len(involved),) * 2),
+            directed=False)
+        if engine == 'ebd' and job[0] == 'Gower' and n_components > 1:
+            raise ValueError("Gower scales by ranges over all samples, so it "
+                             "cannot be computed per component with the ebd "
+                             "engine")
+        order = np.argsort(labels, kind='mergesort')
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+        sizes = np.bincount(labels)
+        tiles, start = [], 0
+        for size in sizes:
+            if tiles and block_size and \
+                    start + size - tiles[-1].start <= block_size:
+                tiles[-1] = slice(tiles[-1].start, start + size)
+            else:
+                tiles.append(slice(start, start + size))
+            start += size
+        a, b = position[a], position[b]
+        tile_of = np.searchsorted([tile.start for tile in tiles], a,
+                                  side='right') - 1
+        by_tile = np.argsort(tile_of, kind='mergesort')
+        by_tile = np.split(by_tile, np.searchsorted(tile_of[by_tile],
+                                                    np.arange(1, len(tiles))))
+
+        table = table.filter(involved, axis='sample', inplace=False)
+        table = table.sort_order(involved[order], axis='sample')
+        tree = None
+        if phylogenetic:
+            tree = _tree.CompactTree.from_treenode(phylogeny)
+        if _prunes(prune, [job]):
+            table, tree = _preprocess(table, tree)
+        starts = {tile.start: i for i, tile in enumerate(tiles)}
+
+        def sink(job, rows, cols, block):
+            members = by_tile[starts[rows.start]]
+            distances[members] = block[a[members] - rows.start,
+                                       b[members] - rows.start]
+        _compute(table, tree, [job], engine, n_jobs,
+                 tiles=[(tile, tile) for tile in tiles], sink=sink)
+
+    result = requested.copy()
+    result['distance'] = distances
+    return qiime2.Metadata(result)
+
+
+def pcoa_landmark(table: biom.Table, metric: str, weighted: bool,
+                  phylogeny: skbio.TreeNode = None, n_landmarks: int = 1000,
+                  dimensions: int = 10, n_check: int = 100, seed: int = None,
+                  engine: str = 'ebd', block_size: int = None,
+                  n_jobs: int = 1,
+                  prune: bool = None)-> skbio.OrdinationResults:
+    # Approximate PCoA from the distances of every sample to n_landmarks
+    # random landmark samples. The exact distances among n_check other random
+    # samples are compared to the embedding to estimate the error.
+    phylogenetic = phylogeny is not None
+    if metric not in (phylogenetic_metrics() if phylogenetic
+                      else non_phylogenetic_metrics()):
+        raise ValueError("Unknown %smetric: %s"
+                         % ('phylogenetic ' if phylogenetic else '', metric))
+    if engine not in engines():
+        raise ValueError("Unknown engine: %s" % engine)
     if table.is_empty():
         raise ValueError("The provided table object is empty")
+    job = resolve_metric(metric, weighted, phylogenetic)
+    random = np.random.RandomState(seed)
+    sample_ids = table.ids(axis='sample')
+    n_samples = len(sample_ids)
+    n_landmarks = min(n_landmarks, n_samples)
+    order = random.permutation(n_samples)
+    table = table.sort_order(sample_ids[order], axis='sample')
+    tree = None
+    if phylogenetic:
+        tree = _tree.CompactTree.from_treenode(phylogeny)
+    if _prunes(prune, [job]):
+        table, tree = _preprocess(table, tree)
+
+    # The first n_landmarks samples of the shuffled table are the landmarks.
+    # As in query, ExpressBetaDiversity runs every block of samples together
+    # with a block of landmarks.
+    if engine == 'ebd' and block_size is None:
+        block_size = n_landmarks
+    landmark_blocks = _blocks(0, n_landmarks, block_size)
+    tiles = [(rows, cols)
+             for rows in landmark_blocks + _blocks(n_landmarks, n_samples,
+                                                   block_size)
+             if rows.start < rows.stop for cols in landmark_blocks]
+    dists = np.zeros((n_samples, n_landmarks))
+
+    def sink(job, rows, cols, block):
+        dists[rows, cols] = block
+    _compute(table, tree, [job], engine, n_jobs, block_size, tiles=tiles,
+             sink=sink)
+    landmark_dists = dists[:n_landmarks]
+    landmark_dists = (landmark_dists + landmark_dists.T) / 2
+    coordinates, eigvals, proportions = _ordination.landmark(
+        landmark_dists, dists, dimensions)
+
+    long_method_name = ('Landmark MDS approximation of principal coordinate '
+                        'analysis on %d landmarks' % n_landmarks)
+    n_check = min(n_check, n_samples)
+    if n_check > 1:
+        checked = np.sort(random.choice(n_samples, n_check, replace=False))
+        exact = _compute(table.filter(table.ids(axis='sample')[checked],
+                                      axis='sample', inplace=False),
+                         tree, [job], engine, n_jobs, block_size)[0]
+        long_method_name += (', relative error %.4g against the exact '
+                             'distances of %d sampled samples'
+                             % (_ordination.relative_error(
+                                 exact, coordinates[checked]), n_check))
+    # Samples go back to the order of the table
+    return _ordination.ordination_results(
+        sample_ids, coordinates[np.argsort(order)], eigvals, proportions,
+        'LMDS', long_method_name)
 
-    # Write table to temp file
-    with tempfile.TemporaryDirectory() as temp_dir_name:
-        table_fp = os.path.join(temp_dir_name, 'otu_table.tsv')
-        with open(table_fp, 'w') as out_table:
-            # We have to iterate through each sample
-            out_table.write("\t" + "\t".join(table.ids(axis='observation')))
-            for sample_id in table.ids(axis='sample'):
-                row = table.data(sample_id)
-                out_table.write("\n" + str(sample_id) + "\t" + \
-                        "\t".join([str(x) for x in row]))
-    # Run ExpressBetaDiversity on them
-        name_map = {'braycurtis': 'Bray-Curtis',
-                    'sorensen': 'Bray-Curtis',
-                    'canberra': 'Canberra',
-                    'chi_squared': 'Chi-squared',
-                    'coeff_similarity': 'CS',
-                    'euclidean': 'Euclidean',
-                    'f_st': 'Fst',
-                    'gower': 'Gower',
-                    'hellinger': 'Hellinger',
-                    'kulczynski': 'Kulczynski',
-                    'lennon': 'Lennon',
-                    'manhattan': 'Manhattan',
-                    'morisita_horn': 'Morisita-Horn',
-                    'pearson': 'Pearson',
-                    'raohp': 'RaoHp',
-                    'soergel': 'Soergel',
-                    'jaccard': 'Soergel',
-                    'ruzicka': 'Soergel',
-                    'tamas_coeff': 'TC',
-                    'weighted_corr': 'WC',
-                    'whittaker': 'Whittaker',
-                    'yue_clayton': 'Yue-Clayton'
-                   }
-        if weighted:
-            weighted = "-w"
-        else:
-            weighted = ""
-        cmd = 'ExpressBetaDiversity -s otu_table.tsv %s -c %s' \
-                                          % (weighted, name_map[metric])
-        subprocess.run(cmd, cwd=temp_dir_name, shell=True)
-        with open(os.path.join(temp_dir_name, 'output.diss'), 'r') as dist_file:
-            nsamples = int(dist_file.readline())
-            dist_mat = np.zeros((nsamples, nsamples))
-            ids = []
-            for i, line in enumerate(dist_file):
-                ids.append(line.split("\t")[0].strip())
-                for j, dist in enumerate(line.split("\t")[1:]):
-                    dist_mat[i,j] = float(dist)
-                    dist_mat[j,i] = float(dist)
-
-    # Suck the data matrix back in
-    # Return a DistanceMatrix object
-    results = skbio.DistanceMatrix(dist_mat, ids)
-
-    return results
 
 def cluster_distance_matrices(dist_mats: DistanceMatrixDirectoryFormat)-> None:
     print(dist_mats)
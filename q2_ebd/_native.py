@@ -0,0 +1,227 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# In-process implementations of the ExpressBetaDiversity calculators. Every
+# calculator works on a matrix of per-sample profiles (one row per sample),
+# where each column carries a weight (1 for features, the branch length for
+# branches of a tree). Weighted profiles are relative abundances, unweighted
+# profiles are presence/absence.
+
+import numpy as np
+
+# Upper bound on the number of cells in the temporary arrays built when a
+# calculator has to look at every (sample, sample, feature) triple.
+BLOCK_CELLS = 2 ** 22
+
+
+def profiles(table, weighted):
+    data = table.matrix_data.T.toarray().astype(np.float64)
+    if weighted:
+        totals = data.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1
+        return data / totals
+    return (data > 0).astype(np.float64)
+
+
+def gower_weights(X, weights):
+    ranges = X.max(axis=0) - X.min(axis=0)
+    present = ranges > 0
+    scaled = np.zeros_like(weights)
+    scaled[present] = weights[present] / ranges[present]
+    total = weights[present].sum()
+    return scaled / total if total else scaled
+
+
+def _blocks(X, Y):
+    step = max(1, BLOCK_CELLS // max(1, Y.shape[0] * Y.shape[1]))
+    for start in range(0, X.shape[0], step):
+        yield slice(start, start + step)
+
+
+def _elementwise(func):
+    def pairwise(X, Y, w):
+        out = np.empty((X.shape[0], Y.shape[0]))
+        for rows in _blocks(X, Y):
+            out[rows] = func(X[rows, None, :], Y[None, :, :], w)
+        return out
+    return pairwise
+
+
+@_elementwise
+def min_sum(x, y, w):
+    return (np.minimum(x, y) * w).sum(axis=-1)
+
+
+@_elementwise
+def _canberra(x, y, w):
+    total = x + y
+    return np.where(total > 0,
+                    w * np.abs(x - y) / np.where(total > 0, total, 1),
+                    0).sum(axis=-1)
+
+
+@_elementwise
+def _chi_squared(x, y, w):
+    total = x + y
+    return np.sqrt(np.where(total > 0,
+                            w * (x - y) ** 2 / np.where(total > 0, total, 1),
+                            0).sum(axis=-1))
+
+
+def _entropy(x):
+    return -x * np.log(np.where(x > 0, x, 1))
+
+
+@_elementwise
+def _rao_hp(x, y, w):
+    return (w * (_entropy((x + y) / 2)
+                 - (_entropy(x) + _entropy(y)) / 2)).sum(axis=-1)
+
+
+def _totals(X, Y, w):
+    return (X @ w)[:, None], (Y @ w)[None, :]
+
+
+def _squares(X, Y, w):
+    return ((X * X) @ w)[:, None], ((Y * Y) @ w)[None, :], (X * w) @ Y.T
+
+
+def _manhattan(sx, sy, shared):
+    return sx + sy - 2 * shared
+
+
+def _bray_curtis(sx, sy, shared):
+    return (sx + sy - 2 * shared) / (sx + sy)
+
+
+def _soergel(sx, sy, shared):
+    return (sx + sy - 2 * shared) / (sx + sy - shared)
+
+
+def _kulczynski(sx, sy, shared):
+    return 1 - (shared / sx + shared / sy) / 2
+
+
+def _lennon(sx, sy, shared):
+    unique = np.minimum(sx - shared, sy - shared)
+    return unique / (shared + unique)
+
+
+def _coeff_similarity(sx, sy, shared):
+    unique = np.maximum(sx - shared, sy - shared)
+    return unique / (shared + unique)
+
+
+# Calculators that only depend on the weighted totals of both samples and on
+# the weighted sum of their element-wise minimum. The sparse engine reuses
+# these with its own minimum sum. On branch profiles, normalized weighted
+# UniFrac reduces to the branch-length weighted Bray-Curtis.
+SHARED_FORMULAS = {'Bray-Curtis': _bray_curtis,
+                   'CS': _coeff_similarity,
+                   'Gower': _manhattan,
+                   'Kulczynski': _kulczynski,
+                   'Lennon': _lennon,
+                   'Manhattan': _manhattan,
+                   'NWU': _bray_curtis,
+                   'Soergel': _soergel}
+
+
+def _from_shared(formula):
+    def pairwise(X, Y, w):
+        sx, sy = _totals(X, Y, w)
+        return formula(sx, sy, min_sum(X, Y, w))
+    return pairwise
+
+
+def _normalize(X, w):
+    totals = X @ w
+    totals[totals == 0] = 1
+    return X / totals[:, None]
+
+
+def _whittaker(X, Y, w):
+    return 1 - min_sum(_normalize(X, w), _normalize(Y, w), w)
+
+
+def _euclidean(X, Y, w):
+    qx, qy, pxy = _squares(X, Y, w)
+    return np.sqrt(np.maximum(qx + qy - 2 * pxy, 0))
+
+
+def _hellinger(X, Y, w):
+    return _euclidean(np.sqrt(_normalize(X, w)), np.sqrt(_normalize(Y, w)), w)
+
+
+def _morisita_horn(X, Y, w):
+    sx, sy = _totals(X, Y, w)
+    qx, qy, pxy = _squares(X, Y, w)
+    return 1 - 2 * pxy / ((qx / sx ** 2 + qy / sy ** 2) * sx * sy)
+
+
+def _yue_clayton(X, Y, w):
+    qx, qy, pxy = _squares(X, Y, w)
+    return 1 - pxy / (qx + qy - pxy)
+
+
+def _tamas_coeff(X, Y, w):
+    qx, qy, pxy = _squares(X, Y, w)
+    return (qx + qy - 2 * pxy) / (qx + qy)
+
+
+def _f_st(X, Y, w):
+    sx, sy = _totals(X, Y, w)
+    qx, qy, pxy = _squares(X, Y, w)
+    between = (qx + qy - 2 * pxy) / 4
+    total = (sx + sy) / 2 - (qx + qy + 2 * pxy) / 4
+    return between / total
+
+
+def _correlation(X, Y, w):
+    total = w.sum()
+    X = X - (X @ w)[:, None] / total
+    Y = Y - (Y @ w)[:, None] / total
+    qx, qy, pxy = _squares(X, Y, w)
+    return 1 - pxy / np.sqrt(qx * qy)
+
+
+def _pearson(X, Y, w):
+    return _correlation(X * w, Y * w, np.ones_like(w))
+
+
+CALCULATORS = {'Canberra': _canberra,
+               'Chi-squared': _chi_squared,
+               'Euclidean': _euclidean,
+               'Fst': _f_st,
+               'Hellinger': _hellinger,
+               'Morisita-Horn': _morisita_horn,
+               'Pearson': _pearson,
+               'RaoHp': _rao_hp,
+               'TC': _tamas_coeff,
+               'WC': _correlation,
+               'Whittaker': _whittaker,
+               'Yue-Clayton': _yue_clayton}
+CALCULATORS.update({calculator: _from_shared(formula)
+                    for calculator, formula in SHARED_FORMULAS.items()})
+
+
+def pairwise(X, Y, calculator, weights=None, reference=None):
+    # Calculators that depend on the whole sample set (Gower's ranges) look at
+    # reference, which defaults to the rows of X and Y.
+    if calculator not in CALCULATORS:
+        raise ValueError("Calculator %s is not available in the native engine"
+                         % calculator)
+    if weights is None:
+        weights = np.ones(X.shape[1])
+    if calculator == 'Gower':
+        if reference is None:
+            reference = np.vstack([X, Y])
+        weights = gower_weights(reference, weights)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dists = CALCULATORS[calculator](X, Y, weights)
+    dists[~np.isfinite(dists)] = 0
+    return dists
@@ -0,0 +1,118 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# Principal coordinates computed from distances: the leading axes of a full
+# distance matrix, or approximately from the distances to a set of landmark
+# samples (landmark MDS, de Silva & Tenenbaum 2004, a Nystrom extension of
+# classical scaling).
+
+import numpy as np
+import pandas as pd
+import scipy.sparse.linalg
+import scipy.spatial.distance
+import skbio
+
+
+def _centered(squared):
+    # Double-centred -1/2 * squared distances, Gower's B matrix
+    row_means = squared.mean(axis=1, keepdims=True)
+    return -0.5 * (squared - row_means - row_means.T + squared.mean())
+
+
+def _padded(eigvals, eigvecs, dimensions):
+    # As in scikit-bio, non-positive eigenvalues are clamped to zero, which
+    # zeroes their axes, and missing axes are added as zeros, so there are
+    # always dimensions of them
+    eigvals = np.maximum(eigvals, 0)
+    missing = dimensions - len(eigvals)
+    if missing > 0:
+        eigvals = np.concatenate([eigvals, np.zeros(missing)])
+        eigvecs = np.hstack([eigvecs, np.zeros((len(eigvecs), missing))])
+    return eigvals, eigvecs
+
+
+def _leading(matrix, dimensions):
+    # The leading eigenpairs of the symmetric matrix, largest first
+    eigvals, eigvecs = np.linalg.eigh(matrix)
+    order = np.argsort(eigvals)[::-1][:dimensions]
+    return _padded(eigvals[order], eigvecs[:, order], dimensions)
+
+
+def _lanczos(squared, dimensions):
+    # The leading eigenpairs of the double-centred squared distances, without
+    # forming the centred matrix
+    def matvec(v):
+        v = np.ravel(v)
+        product = squared @ (v - v.mean())
+        return -0.5 * (product - product.mean())
+    operator = scipy.sparse.linalg.LinearOperator(
+        squared.shape, matvec=matvec, dtype=np.float64)
+    eigvals, eigvecs = scipy.sparse.linalg.eigsh(operator, dimensions,
+                                                 which='LA')
+    order = np.argsort(eigvals)[::-1]
+    return _padded(eigvals[order], eigvecs[:, order], dimensions)
+
+
+def landmark(landmark_dists, sample_dists, dimensions):
+    # landmark_dists is the square matrix of the m landmarks, sample_dists the
+    # n x m distances of every sample to them. Returns the n x k coordinates,
+    # the eigenvalues and the proportion of the landmarks' variance they
+    # explain.
+    squared = np.square(landmark_dists, dtype=np.float64)
+    centered = _centered(squared)
+    total = np.trace(centered)
+    eigvals, eigvecs = _leading(centered, dimensions)
+    # Triangulate every sample from its squared distances to the landmarks,
+    # leaving it at zero on the axes without variance
+    offsets = np.square(sample_dists, dtype=np.float64) - squared.mean(axis=0)
+    scale = np.divide(1, np.sqrt(eigvals), out=np.zeros_like(eigvals),
+                      where=eigvals > 0)
+    coordinates = -0.5 * offsets @ (eigvecs * scale)
+    return coordinates, eigvals, eigvals / total if total else eigvals * 0
+
+
+def pcoa(distance_matrix, dimensions):
+    # Only the leading dimensions axes are computed, with a Lanczos
+    # eigensolver. Small matrices, matrices without any distance and those
+    # ARPACK cannot handle are decomposed in full instead.
+    squared = scipy.spatial.distance.squareform(
+        np.square(distance_matrix.condensed_form(), dtype=np.float64))
+    n_samples = squared.shape[0]
+    # The trace of the centred matrix is the sum of all its eigenvalues
+    total = squared.sum() / (2 * n_samples) if n_samples else 0
+    eigvals = None
+    if dimensions < n_samples - 1 and total:
+        try:
+            eigvals, eigvecs = _lanczos(squared, dimensions)
+        except scipy.sparse.linalg.ArpackError:
+            pass
+    if eigvals is None:
+        eigvals, eigvecs = _leading(_centered(squared), dimensions)
+    return ordination_results(
+        list(distance_matrix.ids), eigvecs * np.sqrt(eigvals), eigvals,
+        eigvals / total if total else eigvals * 0, 'PCoA',
+        'Principal Coordinate Analysis')
+
+
+def relative_error(exact, coordinates):
+    # Norm of the difference between the exact condensed distances and those
+    # in the embedding, relative to the exact ones
+    embedded = scipy.spatial.distance.pdist(coordinates)
+    norm = np.linalg.norm(exact)
+    return np.linalg.norm(exact - embedded) / norm if norm else 0.0
+
+
+def ordination_results(sample_ids, coordinates, eigvals, proportions,
+                       short_method_name, long_method_name):
+    axes = ['PC%d' % (i + 1) for i in range(len(eigvals))]
+    return skbio.OrdinationResults(
+        short_method_name=short_method_name,
+        long_method_name=long_method_name,
+        eigvals=pd.Series(eigvals, index=axes),
+        samples=pd.DataFrame(coordinates, index=sample_ids, columns=axes),
+        proportion_explained=pd.Series(proportions, index=axes))
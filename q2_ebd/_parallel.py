@@ -0,0 +1,32 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# Concurrent execution of independent jobs. The heavy lifting happens either
+# in ExpressBetaDiversity subprocesses or in NumPy/SciPy routines that release
+# the GIL, so a thread per concurrent job is enough to keep the cores busy.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def resolve_n_jobs(n_jobs):
+    if n_jobs < 0:
+        raise ValueError("n_jobs must be 0 (one per CPU) or a positive "
+                         "number, got %d" % n_jobs)
+    return n_jobs or os.cpu_count() or 1
+
+
+def map_jobs(func, items, n_jobs=1):
+    # Results come back in the order of items regardless of which job
+    # finishes first.
+    items = list(items)
+    n_jobs = min(resolve_n_jobs(n_jobs), len(items))
+    if n_jobs <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, items))
@@ -0,0 +1,105 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# The scatter plot of the measures. Sample ids and metadata are stored once
+# in a ColumnDataSource shared by every measure, and a selector switches
+# between measures. Either every measure adds two float32 coordinate columns
+# to that source, or, in the lazy page, each measure is written to a sidecar
+# file of float32 values (the x coordinates of all samples followed by the y
+# coordinates) that is only fetched when the measure is selected, so the page
+# size does not grow with the number of measures. Browsers only fetch the
+# sidecars when the page is served over HTTP, as `qiime tools view` and
+# QIIME 2 View do.
+
+import os
+
+import numpy as np
+from bokeh.io import save
+from bokeh.layouts import column
+from bokeh.models import ColumnDataSource, CustomJS, HoverTool, Select
+from bokeh.plotting import figure
+from bokeh.resources import INLINE
+
+FRAMES_DIR = 'ebd-frames'
+
+_SWITCH = """
+const i = select.options.indexOf(select.value);
+renderer.glyph.x = {field: 'x' + i};
+renderer.glyph.y = {field: 'y' + i};
+source.change.emit();
+"""
+
+_FETCH = """
+const path = paths[select.options.indexOf(select.value)];
+fetch(path).then((response) => response.arrayBuffer()).then((buffer) => {
+    const values = new Float32Array(buffer);
+    const n = values.length / 2;
+    source.data = Object.assign({}, source.data,
+                                {x: values.slice(0, n), y: values.slice(n)});
+});
+"""
+
+
+def _coordinates(coordinates):
+    coordinates = np.asarray(coordinates, dtype=np.float32)
+    return coordinates[:, 0].copy(), coordinates[:, 1].copy()
+
+
+def _source_data(samples, metadata=None):
+    # Metadata columns get positional names so they cannot clash with the
+    # coordinate columns; the tooltips show their real names.
+    data = {'sample-id': [str(s) for s in samples]}
+    tooltips = [('id', '@{sample-id}')]
+    if metadata is not None:
+        df = metadata.to_dataframe().reindex([str(s) for s in samples])
+        for i, name in enumerate(df.columns):
+            data['metadata-%d' % i] = \
+                df[name].astype(object).fillna('').astype(str).tolist()
+            tooltips.append((name, '@{metadata-%d}' % i))
+    return data, tooltips
+
+
+def _save(output_dir, html_name, data, tooltips, x, y, measures, callback,
+          args):
+    source = ColumnDataSource(data=data)
+    plot = figure(height=500, width=500, x_axis_label='PC1',
+                  y_axis_label='PC2', tools='pan,wheel_zoom,box_select,reset')
+    renderer = plot.scatter(x, y, source=source, size=5)
+    plot.add_tools(HoverTool(tooltips=tooltips))
+    select = Select(title='measure', value=measures[0], options=measures)
+    select.js_on_change('value', CustomJS(
+        args=dict(source=source, select=select, renderer=renderer, **args),
+        code=callback))
+    save(column(select, plot), os.path.join(output_dir, html_name),
+         resources=INLINE, title='q2-ebd')
+
+
+def save_embedded(output_dir, samples, frames, metadata=None,
+                  html_name='ebd.html'):
+    # frames lists (measure, n x 2 coordinates) pairs in the order of the
+    # measure selector, with rows following samples.
+    data, tooltips = _source_data(samples, metadata)
+    for i, (_, coordinates) in enumerate(frames):
+        data['x%d' % i], data['y%d' % i] = _coordinates(coordinates)
+    _save(output_dir, html_name, data, tooltips, 'x0', 'y0',
+          [measure for measure, _ in frames], _SWITCH, {})
+
+
+def save_lazy(output_dir, samples, frames, metadata=None,
+              html_name='ebd.html'):
+    os.makedirs(os.path.join(output_dir, FRAMES_DIR), exist_ok=True)
+    paths = []
+    for i, (_, coordinates) in enumerate(frames):
+        path = '%s/%d.f32' % (FRAMES_DIR, i)
+        np.concatenate(_coordinates(coordinates)).astype('<f4').tofile(
+            os.path.join(output_dir, path))
+        paths.append(path)
+    data, tooltips = _source_data(samples, metadata)
+    data['x'], data['y'] = _coordinates(frames[0][1])
+    _save(output_dir, html_name, data, tooltips, 'x', 'y',
+          [measure for measure, _ in frames], _FETCH, {'paths': paths})
@@ -0,0 +1,103 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# Sparse versions of the L1-family calculators in _native. They walk the
+# CSR/CSC structure of the profiles directly, so the work done for a pair of
+# samples only depends on the features they share.
+
+import numpy as np
+import scipy.sparse
+
+from q2_ebd import _native
+
+
+def profiles(table, weighted):
+    data = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=np.float64)
+    data.eliminate_zeros()
+    if weighted:
+        totals = np.asarray(data.sum(axis=1)).ravel()
+        totals[totals == 0] = 1
+        return scipy.sparse.diags(1 / totals) @ data
+    data.data[:] = 1
+    return data
+
+
+def _shared(X, Y, w, combine):
+    # For every row of X, gather the nonzeros of Y in the columns that row
+    # touches and reduce them per row of Y.
+    X = scipy.sparse.csr_matrix(X)
+    Y = scipy.sparse.csc_matrix(Y)
+    out = np.zeros((X.shape[0], Y.shape[0]))
+    for i in range(X.shape[0]):
+        cols = X.indices[X.indptr[i]:X.indptr[i + 1]]
+        vals = X.data[X.indptr[i]:X.indptr[i + 1]]
+        starts = Y.indptr[cols]
+        counts = Y.indptr[cols + 1] - starts
+        if not counts.sum():
+            continue
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        idx = np.arange(counts.sum()) + offsets
+        out[i] = np.bincount(Y.indices[idx],
+                             combine(np.repeat(vals, counts), Y.data[idx],
+                                     np.repeat(w[cols], counts)),
+                             minlength=Y.shape[0])
+    return out
+
+
+def min_sum(X, Y, w):
+    return _shared(X, Y, w, lambda x, y, w: w * np.minimum(x, y))
+
+
+def _canberra(X, Y, w):
+    # Features present in only one of the samples contribute their full
+    # weight, shared features contribute w * |x - y| / (x + y).
+    nx = (X != 0) @ w
+    ny = (Y != 0) @ w
+    shared = _shared(X, Y, w,
+                     lambda x, y, w: w * (1 + 2 * np.minimum(x, y) / (x + y)))
+    return nx[:, None] + ny[None, :] - shared
+
+
+def gower_weights(X, weights):
+    X = scipy.sparse.csc_matrix(X)
+    highest = X.max(axis=0).toarray().ravel()
+    lowest = X.min(axis=0).toarray().ravel()
+    ranges = highest - lowest
+    present = ranges > 0
+    scaled = np.zeros_like(weights)
+    scaled[present] = weights[present] / ranges[present]
+    total = weights[present].sum()
+    return scaled / total if total else scaled
+
+
+def calculators():
+    return set(_native.SHARED_FORMULAS) | {'Canberra'}
+
+
+def pairwise(X, Y, calculator, weights=None, reference=None):
+    # Calculators that depend on the whole sample set (Gower's ranges) look at
+    # reference, which defaults to the rows of X and Y.
+    if calculator not in calculators():
+        raise ValueError("Calculator %s is not available in the sparse engine"
+                         % calculator)
+    if weights is None:
+        weights = np.ones(X.shape[1])
+    if calculator == 'Gower':
+        if reference is None:
+            reference = scipy.sparse.vstack([X, Y])
+        weights = gower_weights(reference, weights)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if calculator == 'Canberra':
+            dists = _canberra(X, Y, weights)
+        else:
+            sx = X @ weights
+            sy = Y @ weights
+            dists = _native.SHARED_FORMULAS[calculator](
+                sx[:, None], sy[None, :], min_sum(X, Y, weights))
+    dists[~np.isfinite(dists)] = 0
+    return dists
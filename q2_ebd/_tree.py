@@ -0,0 +1,180 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# A compact, array-backed representation of rooted trees. Nodes are stored in
+# postorder (the root last), so the subtree of node i is the contiguous range
+# [i - size[i] + 1, i] and children always come before their parents. Branch
+# lengths that are not set are stored as NaN.
+
+import collections
+import hashlib
+import threading
+
+import numpy as np
+import scipy.sparse
+
+# Number of trees kept by CompactTree.from_treenode
+CACHE_SIZE = 8
+
+
+class CompactTree:
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, names, lengths, children):
+        # names and lengths are per node, children lists the child indices of
+        # every node, all in postorder.
+        self.names = np.array(names, dtype=object)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        n_children = np.array([len(c) for c in children], dtype=np.int64)
+        self.child_ptr = np.concatenate([[0], np.cumsum(n_children)])
+        self.children = np.fromiter(
+            (child for c in children for child in c), dtype=np.int64,
+            count=int(self.child_ptr[-1]))
+        self.parent = np.full(len(names), -1, dtype=np.int64)
+        self.parent[self.children] = np.repeat(np.arange(len(names)),
+                                               n_children)
+        self.size = np.ones(len(names), dtype=np.int64)
+        for i in np.flatnonzero(n_children):
+            self.size[i] += self.size[self._children_of(i)].sum()
+        self.is_tip = n_children == 0
+        self.tip_index = {name: i for i, name
+                          in zip(np.flatnonzero(self.is_tip),
+                                 self.names[self.is_tip])}
+        self._digest = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = _digest(self.names, self.lengths,
+                                   np.diff(self.child_ptr))
+        return self._digest
+
+    @classmethod
+    def from_treenode(cls, phylogeny):
+        # One traversal collects the per-node data, which is enough to hash
+        # the tree and reuse a tree built earlier from the same content.
+        names, lengths, n_children = [], [], []
+        for node in phylogeny.postorder(include_self=True):
+            names.append(node.name)
+            lengths.append(np.nan if node.length is None else node.length)
+            n_children.append(len(node.children))
+        digest = _digest(names, lengths, n_children)
+        with cls._cache_lock:
+            if digest in cls._cache:
+                cls._cache.move_to_end(digest)
+                return cls._cache[digest]
+
+        children, stack = [], []
+        for i, count in enumerate(n_children):
+            if count:
+                children.append(stack[-count:])
+                del stack[-count:]
+            else:
+                children.append([])
+            stack.append(i)
+        tree = cls(names, lengths, children)
+        tree._digest = digest
+        with cls._cache_lock:
+            cls._cache[digest] = tree
+            while len(cls._cache) > CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return tree
+
+    def _children_of(self, i):
+        return self.children[self.child_ptr[i]:self.child_ptr[i + 1]]
+
+    def prune(self, names):
+        # Returns the tree restricted to the tips in names. Internal nodes
+        # left with a single child are collapsed into that child, adding up
+        # the branch lengths, so every root-to-tip path keeps its length. A
+        # single child of the root is kept as a stem for the same reason.
+        names = set(names)
+        missing = names - set(self.tip_index)
+        if missing:
+            raise ValueError("Feature %s is not a tip of the phylogeny"
+                             % sorted(missing)[0])
+        root = len(self) - 1
+        kept = np.zeros(len(self), dtype=bool)
+        kept[[self.tip_index[name] for name in names]] = True
+        new_names, new_lengths, new_children = [], [], []
+        remap = np.full(len(self), -1, dtype=np.int64)
+        for i in range(len(self)):
+            if self.is_tip[i]:
+                if kept[i]:
+                    remap[i] = len(new_names)
+                    new_names.append(self.names[i])
+                    new_lengths.append(self.lengths[i])
+                    new_children.append([])
+                continue
+            children = [remap[c] for c in self._children_of(i) if kept[c]]
+            if not children:
+                continue
+            kept[i] = True
+            if len(children) == 1 and i != root:
+                child = children[0]
+                if not np.isnan(self.lengths[i]):
+                    new_lengths[child] = np.nansum([new_lengths[child],
+                                                    self.lengths[i]])
+                remap[i] = child
+                continue
+            remap[i] = len(new_names)
+            new_names.append(self.names[i])
+            new_lengths.append(self.lengths[i])
+            new_children.append(children)
+        return CompactTree(new_names, new_lengths, new_children)
+
+    def branch_incidence(self, feature_ids):
+        # Rows follow feature_ids, columns are the branches of the tree (every
+        # node but the root, in postorder). Entry (t, b) is 1 when tip t lies
+        # below branch b, i.e. within the contiguous subtree range of b.
+        branches = np.arange(len(self) - 1)
+        tips = np.flatnonzero(self.is_tip)
+        first = np.searchsorted(tips, branches - self.size[:-1] + 1)
+        last = np.searchsorted(tips, branches, side='right')
+        counts = last - first
+        offsets = np.repeat(first - np.cumsum(counts) + counts, counts)
+        tip_ranks = np.arange(counts.sum()) + offsets
+        by_branch = scipy.sparse.csr_matrix(
+            (np.ones(len(tip_ranks)), tip_ranks,
+             np.concatenate([[0], np.cumsum(counts)])),
+            shape=(len(branches), len(tips)))
+
+        rank = {name: r for r, name in enumerate(self.names[tips])}
+        missing = [f for f in feature_ids if f not in rank]
+        if missing:
+            raise ValueError("Feature %s is not a tip of the phylogeny"
+                             % missing[0])
+        rows = [rank[f] for f in feature_ids]
+        incidence = scipy.sparse.csr_matrix(by_branch.T)[rows]
+        return incidence, np.nan_to_num(self.lengths[:-1])
+
+
+def _digest(names, lengths, n_children):
+    digest = hashlib.sha256()
+    digest.update("\0".join('' if name is None else str(name)
+                            for name in names).encode('utf-8'))
+    digest.update(np.asarray(lengths, dtype=np.float64).tobytes())
+    digest.update(np.asarray(n_children, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def branch_profiles(profiles, incidence, weighted):
+    branches = profiles @ incidence
+    if scipy.sparse.issparse(branches):
+        branches = scipy.sparse.csr_matrix(branches)
+        if not weighted:
+            branches.data[:] = 1
+        return branches
+    branches = np.asarray(branches)
+    if weighted:
+        return branches
+    return (branches > 0).astype(np.float64)
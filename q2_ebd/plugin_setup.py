@@ -7,15 +7,18 @@
 # ----------------------------------------------------------------------------
 
 from qiime2.plugin import (Plugin, Str, Properties, Choices, Int, Bool, Range,
-                           Float, Set, Visualization, Metadata, MetadataColumn,
-                           Categorical, Citations)
+                           Float, Set, Collection, Visualization, Metadata,
+                           MetadataColumn, Categorical, Citations)
 from qiime2.plugin import SemanticType
 
 import q2_ebd
 from q2_ebd._method import phylogenetic_metrics, non_phylogenetic_metrics, \
+                           all_metrics, engines, precisions, \
                            cluster_distance_matrices, plot
 from q2_types.feature_table import FeatureTable, Frequency
 from q2_types.distance_matrix import DistanceMatrix
+from q2_types.metadata import ImmutableMetadata
+from q2_types.ordination import PCoAResults
 from q2_types.tree import Phylogeny, Rooted
 
 
@@ -33,6 +36,48 @@ plugin = Plugin(
     short_description='Plugin for exploring community diversity.',
 )
 
+cache_parameters = {'cache_dir': Str,
+                    'cache_size': Int % Range(1, None)}
+cache_parameter_descriptions = {
+    'cache_dir': ('Directory of a persistent cache of computed distance '
+                  'matrices. Results are keyed by the table contents, the '
+                  'tree, the calculator, the weighting and the engine (for '
+                  '"ebd", the binary itself), and are reused instead of being '
+                  'recomputed. No cache is used if this is not provided.'),
+    'cache_size': ('Size limit of the cache directory in MiB. The least '
+                   'recently used matrices are evicted beyond it.')
+}
+prune_description = ('Drop features without counts in any sample and, for '
+                     'phylogenetic metrics, shear the tree down to the '
+                     'remaining features before computing distances. '
+                     'Single-child internal nodes are collapsed with their '
+                     'branch lengths added up, so root-to-tip path lengths '
+                     'are preserved. By default this is only done for '
+                     'metrics whose distances it cannot change; it changes '
+                     'those of pearson, weighted_corr, complete_tree, mnnd '
+                     'and mpd, which are only pruned when this is set.')
+precision_description = ('Floating point precision in which the distance '
+                         'matrices are stored, cached and returned. float32 '
+                         'halves memory and disk use; ExpressBetaDiversity '
+                         'prints fewer significant digits than float32 '
+                         'holds anyway.')
+parallel_parameters = {'block_size': Int % Range(1, None),
+                       'n_jobs': Int % Range(0, None),
+                       'memmap_dir': Str}
+parallel_parameter_descriptions = {
+    'block_size': ('Split the samples into blocks of this many samples and '
+                   'compute every pair of blocks as an independent job, so '
+                   'that one large matrix can be spread over several '
+                   'workers. The whole matrix is computed in one job if '
+                   'this is not provided.'),
+    'n_jobs': ('The number of jobs (distance matrices, or blocks of them) '
+               'computed concurrently. 0 runs one job per available CPU.'),
+    'memmap_dir': ('Directory in which the distance matrices are assembled '
+                   'as disk-backed memory maps instead of in RAM, for sample '
+                   'counts whose matrices do not fit in memory. The files are '
+                   'left in place for the caller to remove.')
+}
+
 #plugin.methods.register_function(
 #    function=cluster_distance_matrices,
 #    inputs={'distance_matrix_dir': DistanceMatrixDirectory},
@@ -50,7 +95,12 @@ plugin.methods.register_function(
     inputs={'table': FeatureTable[Frequency],
             'phylogeny': Phylogeny[Rooted]},
     parameters={'metric': Str % Choices(phylogenetic_metrics()),
-                'weighted': Bool},
+                'weighted': Bool,
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'precision': Str % Choices(precisions()),
+                **parallel_parameters,
+                **cache_parameters},
     outputs=[('distance_matrix', DistanceMatrix % Properties('phylogenetic'))],
     input_descriptions={
         'table': ('The feature table containing the samples over which beta '
@@ -63,7 +113,17 @@ plugin.methods.register_function(
     },
     parameter_descriptions={
         'metric': 'The beta diversity metric to be computed.',
-        'weighted': 'True if you wish to use the weighted version of the specific measure.'
+        'weighted': 'True if you wish to use the weighted version of the specific measure.',
+        'engine': ('Where the measure is computed: "ebd" runs the '
+                   'ExpressBetaDiversity binary, "native" computes it '
+                   'in-process on branch profiles derived from the tree and '
+                   '"sparse" does the same on sparse branch profiles for the '
+                   'L1-family calculators. The complete_tree, mnnd and mpd '
+                   'metrics are only available through "ebd".'),
+        'prune': prune_description,
+        'precision': precision_description,
+        **parallel_parameter_descriptions,
+        **cache_parameter_descriptions
     },
     output_descriptions={'distance_matrix': 'The resulting distance matrix.'},
     name='Beta diversity (phylogenetic)',
@@ -77,7 +137,12 @@ plugin.methods.register_function(
     function=q2_ebd.beta,
     inputs={'table': FeatureTable[Frequency]},
     parameters={'metric': Str % Choices(non_phylogenetic_metrics()),
-                'weighted': Bool},
+                'weighted': Bool,
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'precision': Str % Choices(precisions()),
+                **parallel_parameters,
+                **cache_parameters},
     outputs=[('distance_matrix', DistanceMatrix)],
     input_descriptions={
         'table': ('The feature table containing the samples over which beta '
@@ -85,7 +150,18 @@ plugin.methods.register_function(
     },
     parameter_descriptions={
         'metric': 'The beta diversity metric to be computed.',
-        'weighted': 'True if you wish to use the weighted version of the specific measure.'
+        'weighted': 'True if you wish to use the weighted version of the specific measure.',
+        'engine': ('Where the measure is computed: "ebd" runs the '
+                   'ExpressBetaDiversity binary, "native" computes it '
+                   'in-process with NumPy and "sparse" computes it directly '
+                   'on the sparse table, which is only available for the '
+                   'Bray-Curtis, Canberra, Gower, Kulczynski, Lennon, '
+                   'Manhattan, Soergel and coefficient of similarity '
+                   'calculators.'),
+        'prune': prune_description,
+        'precision': precision_description,
+        **parallel_parameter_descriptions,
+        **cache_parameter_descriptions
     },
     output_descriptions={'distance_matrix': 'The resulting distance matrix.'},
     name='Beta diversity',
@@ -94,12 +170,359 @@ plugin.methods.register_function(
     citations=[citations['parks2013measures']]
 )
 
+plugin.methods.register_function(
+    function=q2_ebd.beta_phylogenetic_many,
+    inputs={'table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metrics': Set[Str % Choices(phylogenetic_metrics())],
+                'weighted': Bool,
+                'unweighted': Bool,
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'precision': Str % Choices(precisions()),
+                **parallel_parameters,
+                **cache_parameters},
+    outputs=[('distance_matrices',
+              Collection[DistanceMatrix % Properties('phylogenetic')])],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.'),
+        'phylogeny': ('Phylogenetic tree containing tip identifiers that '
+                      'correspond to the feature identifiers in the table. '
+                      'This tree can contain tip ids that are not present in '
+                      'the table, but all feature ids in the table must be '
+                      'present in this tree.')
+    },
+    parameter_descriptions={
+        'metrics': 'The beta diversity metrics to be computed.',
+        'weighted': 'Compute the weighted version of every metric.',
+        'unweighted': 'Compute the unweighted version of every metric.',
+        'engine': 'Where the measures are computed, as in beta-phylogenetic.',
+        'prune': prune_description,
+        'precision': precision_description,
+        **parallel_parameter_descriptions,
+        **cache_parameter_descriptions
+    },
+    output_descriptions={
+        'distance_matrices': ('The resulting distance matrices, keyed by '
+                              'metric and weighting, e.g. '
+                              'braycurtis_weighted.')},
+    name='Beta diversity (phylogenetic) for several metrics',
+    description=("Computes several phylogenetic beta diversity metrics, "
+                 "weighted and/or unweighted, for all pairs of samples in a "
+                 "feature table. The table and tree are exported once and "
+                 "shared by every metric."),
+    citations=[citations['parks2013measures']]
+)
+
+
+plugin.methods.register_function(
+    function=q2_ebd.beta_many,
+    inputs={'table': FeatureTable[Frequency]},
+    parameters={'metrics': Set[Str % Choices(non_phylogenetic_metrics())],
+                'weighted': Bool,
+                'unweighted': Bool,
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'precision': Str % Choices(precisions()),
+                **parallel_parameters,
+                **cache_parameters},
+    outputs=[('distance_matrices', Collection[DistanceMatrix])],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.')
+    },
+    parameter_descriptions={
+        'metrics': 'The beta diversity metrics to be computed.',
+        'weighted': 'Compute the weighted version of every metric.',
+        'unweighted': 'Compute the unweighted version of every metric.',
+        'engine': 'Where the measures are computed, as in beta.',
+        'prune': prune_description,
+        'precision': precision_description,
+        **parallel_parameter_descriptions,
+        **cache_parameter_descriptions
+    },
+    output_descriptions={
+        'distance_matrices': ('The resulting distance matrices, keyed by '
+                              'metric and weighting, e.g. '
+                              'braycurtis_weighted.')},
+    name='Beta diversity for several metrics',
+    description=("Computes several beta diversity metrics, weighted and/or "
+                 "unweighted, for all pairs of samples in a feature table. "
+                 "The table is exported once and shared by every metric."),
+    citations=[citations['parks2013measures']]
+)
+
+plugin.methods.register_function(
+    function=q2_ebd.beta_stratified,
+    inputs={'table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metric': Str % Choices(all_metrics()),
+                'weighted': Bool,
+                'group_column': MetadataColumn[Categorical],
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'precision': Str % Choices(precisions()),
+                **parallel_parameters,
+                **cache_parameters},
+    outputs=[('distance_matrices', Collection[DistanceMatrix])],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.'),
+        'phylogeny': ('Phylogenetic tree for phylogenetic metrics, as in '
+                      'beta-phylogenetic.')
+    },
+    parameter_descriptions={
+        'metric': ('The beta diversity metric to be computed, one of the '
+                   'phylogenetic metrics if and only if a phylogeny is '
+                   'provided.'),
+        'weighted': 'True if you wish to use the weighted version of the specific measure.',
+        'group_column': ('The metadata category partitioning the samples. '
+                         'Samples are only compared within their group, '
+                         'and samples without a group are left out.'),
+        'engine': 'Where the measure is computed, as in beta.',
+        'prune': prune_description,
+        'precision': precision_description,
+        **parallel_parameter_descriptions,
+        'n_jobs': ('The number of groups computed concurrently. 0 runs one '
+                   'group per available CPU.'),
+        **cache_parameter_descriptions
+    },
+    output_descriptions={
+        'distance_matrices': ('One distance matrix per group, keyed by the '
+                              'group.')},
+    name='Beta diversity within groups of samples',
+    description=("Computes a beta diversity metric separately for each group "
+                 "of samples of a metadata category, so that only samples "
+                 "of the same group are compared."),
+    citations=[citations['parks2013measures']]
+)
+
+plugin.methods.register_function(
+    function=q2_ebd.extend,
+    inputs={'distance_matrix': DistanceMatrix,
+            'table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metric': Str % Choices(all_metrics()),
+                'weighted': Bool,
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'precision': Str % Choices(precisions()),
+                **parallel_parameters},
+    outputs=[('extended_distance_matrix', DistanceMatrix)],
+    input_descriptions={
+        'distance_matrix': ('A distance matrix computed earlier with the same '
+                            'metric and settings for a subset of the samples '
+                            'in the table.'),
+        'table': ('The feature table containing every sample, those of the '
+                  'distance matrix and the ones to add.'),
+        'phylogeny': ('Phylogenetic tree for phylogenetic metrics, as in '
+                      'beta-phylogenetic.')
+    },
+    parameter_descriptions={
+        'metric': ('The beta diversity metric of the distance matrix, one of '
+                   'the phylogenetic metrics if a phylogeny is provided.'),
+        'weighted': 'True if you wish to use the weighted version of the specific measure.',
+        'engine': ('Where the new distances are computed, as in beta. With '
+                   '"ebd" and no block size, the existing samples are run in '
+                   'blocks as large as the number of new samples.'),
+        'prune': prune_description,
+        'precision': precision_description,
+        **parallel_parameter_descriptions
+    },
+    output_descriptions={
+        'extended_distance_matrix': ('The distance matrix with the samples of '
+                                     'the table that it did not contain '
+                                     'appended.')},
+    name='Extend a distance matrix with new samples',
+    description=("Appends the samples of a feature table that are missing "
+                 "from an existing distance matrix, computing only their "
+                 "distances to the existing samples and to each other. The "
+                 "gower metric cannot be extended because it depends on all "
+                 "samples."),
+    citations=[citations['parks2013measures']]
+)
+
+plugin.methods.register_function(
+    function=q2_ebd.query,
+    inputs={'query_table': FeatureTable[Frequency],
+            'reference_table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metric': Str % Choices(all_metrics()),
+                'weighted': Bool,
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'block_size': parallel_parameters['block_size'],
+                'n_jobs': parallel_parameters['n_jobs']},
+    outputs=[('distances', ImmutableMetadata)],
+    input_descriptions={
+        'query_table': ('The feature table containing the query samples.'),
+        'reference_table': ('The feature table containing the reference '
+                            'samples. No sample may be in both tables.'),
+        'phylogeny': ('Phylogenetic tree for phylogenetic metrics, as in '
+                      'beta-phylogenetic.')
+    },
+    parameter_descriptions={
+        'metric': ('The beta diversity metric to be computed, one of the '
+                   'phylogenetic metrics if and only if a phylogeny is '
+                   'provided.'),
+        'weighted': 'True if you wish to use the weighted version of the specific measure.',
+        'engine': ('Where the distances are computed, as in beta. With '
+                   '"ebd" and no block size, the reference samples are run '
+                   'in blocks as large as the number of query samples.'),
+        'prune': prune_description,
+        'block_size': parallel_parameter_descriptions['block_size'],
+        'n_jobs': parallel_parameter_descriptions['n_jobs']
+    },
+    output_descriptions={
+        'distances': ('The distances with one row per query sample and one '
+                      'column per reference sample.')},
+    name='Distances from query samples to reference samples',
+    description=("Computes the distances from every query sample to every "
+                 "reference sample only, instead of the square distance "
+                 "matrix of all of them."),
+    citations=[citations['parks2013measures']]
+)
+
+plugin.methods.register_function(
+    function=q2_ebd.beta_pairs,
+    inputs={'table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metric': Str % Choices(all_metrics()),
+                'weighted': Bool,
+                'pairs': Metadata,
+                'metadata': Metadata,
+                'subject_column': Str,
+                'time_column': Str,
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'block_size': parallel_parameters['block_size'],
+                'n_jobs': parallel_parameters['n_jobs']},
+    outputs=[('distances', ImmutableMetadata)],
+    input_descriptions={
+        'table': ('The feature table containing the samples of the pairs.'),
+        'phylogeny': ('Phylogenetic tree for phylogenetic metrics, as in '
+                      'beta-phylogenetic.')
+    },
+    parameter_descriptions={
+        'metric': ('The beta diversity metric to be computed, one of the '
+                   'phylogenetic metrics if and only if a phylogeny is '
+                   'provided.'),
+        'weighted': 'True if you wish to use the weighted version of the specific measure.',
+        'pairs': ('The sample pairs to compute, one per row, in the '
+                  'sample_a and sample_b columns.'),
+        'metadata': ('Sample metadata from which the pairs of consecutive '
+                     'time points of every subject are taken, instead of '
+                     'pairs. Samples missing from the table or without a '
+                     'subject or time are skipped.'),
+        'subject_column': 'The metadata column identifying the subject.',
+        'time_column': ('The metadata column ordering the samples of a '
+                        'subject.'),
+        'engine': ('Where the distances are computed, as in beta. Samples '
+                   'linked by pairs are computed together as one small '
+                   'matrix.'),
+        'prune': prune_description,
+        'block_size': ('Pack the groups of linked samples into jobs of up to '
+                       'this many samples, so that the ebd engine is not '
+                       'started once per group. Every group is its own job '
+                       'if this is not provided.'),
+        'n_jobs': parallel_parameter_descriptions['n_jobs']
+    },
+    output_descriptions={
+        'distances': ('One row per pair with the sample_a, sample_b and '
+                      'distance columns, plus the subject and both time '
+                      'points when pairs are taken from metadata.')},
+    name='Beta diversity for a list of sample pairs',
+    description=("Computes a beta diversity metric only for the requested "
+                 "pairs of samples, given explicitly or as the consecutive "
+                 "time points of each subject, and returns them as a "
+                 "long-form table."),
+    citations=[citations['parks2013measures']]
+)
+
+plugin.methods.register_function(
+    function=q2_ebd.pcoa_landmark,
+    inputs={'table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metric': Str % Choices(all_metrics()),
+                'weighted': Bool,
+                'n_landmarks': Int % Range(2, None),
+                'dimensions': Int % Range(1, None),
+                'n_check': Int % Range(0, None),
+                'seed': Int % Range(0, None),
+                'engine': Str % Choices(engines()),
+                'prune': Bool,
+                'block_size': parallel_parameters['block_size'],
+                'n_jobs': parallel_parameters['n_jobs']},
+    outputs=[('pcoa', PCoAResults)],
+    input_descriptions={
+        'table': ('The feature table containing the samples to ordinate.'),
+        'phylogeny': ('Phylogenetic tree for phylogenetic metrics, as in '
+                      'beta-phylogenetic.')
+    },
+    parameter_descriptions={
+        'metric': ('The beta diversity metric to be computed, one of the '
+                   'phylogenetic metrics if and only if a phylogeny is '
+                   'provided.'),
+        'weighted': 'True if you wish to use the weighted version of the specific measure.',
+        'n_landmarks': ('The number of randomly chosen landmark samples. '
+                        'Only the distances from every sample to the '
+                        'landmarks are computed.'),
+        'dimensions': 'The number of principal coordinates to compute.',
+        'n_check': ('The number of random samples whose exact distances are '
+                    'computed to estimate the error of the approximation, '
+                    'which is reported in the method name of the results. 0 '
+                    'skips the estimate.'),
+        'seed': 'Seed of the random choice of landmarks and checked samples.',
+        'engine': ('Where the distances are computed, as in beta. With '
+                   '"ebd" and no block size, the samples are run in blocks '
+                   'as large as the number of landmarks.'),
+        'prune': prune_description,
+        'block_size': parallel_parameter_descriptions['block_size'],
+        'n_jobs': parallel_parameter_descriptions['n_jobs']
+    },
+    output_descriptions={'pcoa': 'The approximate principal coordinates.'},
+    name='Approximate principal coordinate analysis from landmarks',
+    description=("Approximates the principal coordinates of all samples by "
+                 "landmark multidimensional scaling (a Nystrom extension): "
+                 "the landmarks are ordinated exactly and every other "
+                 "sample is placed from its distances to them, so only "
+                 "samples x landmarks distances are computed."),
+    citations=[citations['parks2013measures']]
+)
+
 plugin.visualizers.register_function(
     function=q2_ebd.plot,
-    inputs={'distance_matrix': Set[DistanceMatrix]},
+    inputs={'distance_matrix': Set[DistanceMatrix],
+            'pcoa': Set[PCoAResults]},
     input_descriptions={'distance_matrix': 'Distance matrix to be plotted. Can be \
-                                            repeated to display more than one.'},
-    parameters={},
+                                            repeated to display more than one.',
+                        'pcoa': ('Precomputed PCoA results to be plotted as '
+                                 'they are. Can be repeated, and combined '
+                                 'with distance matrices.')},
+    parameters={'dimensions': Int % Range(2, None),
+                'n_jobs': Int % Range(0, None),
+                'lazy': Bool,
+                'metadata': Metadata,
+                **cache_parameters},
+    parameter_descriptions={
+        'dimensions': ('The number of leading principal coordinates computed '
+                       'for each distance matrix. Only these axes are '
+                       'computed, with an iterative eigensolver.'),
+        'n_jobs': ('The number of distance matrices loaded and ordinated '
+                   'concurrently. 0 runs one per available CPU.'),
+        'cache_dir': ('Directory of a persistent cache of the principal '
+                      'coordinates of distance matrices, keyed by artifact '
+                      'UUID, so that plotting the same matrices again skips '
+                      'loading and ordinating them. No cache is used if this '
+                      'is not provided.'),
+        'cache_size': cache_parameter_descriptions['cache_size'],
+        'lazy': ('Write the coordinates of every measure to a separate file '
+                 'next to the page, fetched only when the measure is '
+                 'selected, so that the page stays small however many '
+                 'measures are plotted.'),
+        'metadata': ('Sample metadata shown when hovering over a sample. It '
+                     'is stored once and shared by every measure.')},
     name='PCoA Plot',
     description=("Not yet implemented"),
     citations=[]
@@ -0,0 +1,169 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+import numpy.testing as npt
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_ebd import beta, _cache, _method, _ordination
+from q2_ebd.tests.test_method import make_table
+
+
+class DistanceMatrixCacheTests(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='q2-ebd-test-')
+        self.dists = np.arange(6, dtype=float)
+        self.ids = ['a', 'b', 'c', 'd']
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def entries(self):
+        return sorted(name for name in os.listdir(self.temp_dir.name)
+                      if name.endswith('.npz'))
+
+    def age(self, cache, key, seconds):
+        path = cache._path(key)
+        mtime = os.stat(path).st_mtime - seconds
+        os.utime(path, (mtime, mtime))
+
+    def test_get_put(self):
+        cache = _cache.DistanceMatrixCache(self.temp_dir.name, 2 ** 20)
+        self.assertIsNone(cache.get('key'))
+        cache.put('key', self.dists, self.ids)
+        npt.assert_array_equal(cache.get('key'), self.dists)
+
+    def test_get_corrupt(self):
+        cache = _cache.DistanceMatrixCache(self.temp_dir.name, 2 ** 20)
+        with open(cache._path('key'), 'w') as fh:
+            fh.write('not an archive')
+        self.assertIsNone(cache.get('key'))
+
+    def test_evicts_least_recently_used(self):
+        cache = _cache.DistanceMatrixCache(self.temp_dir.name, 2 ** 20)
+        cache.put('old', self.dists, self.ids)
+        cache.put('used', self.dists, self.ids)
+        self.age(cache, 'old', 20)
+        self.age(cache, 'used', 30)
+        # Reading an entry makes it the most recently used
+        cache.get('used')
+        cache.max_size = os.stat(cache._path('used')).st_size * 2
+        cache.put('new', self.dists, self.ids)
+        self.assertEqual(self.entries(), ['new.npz', 'used.npz'])
+
+    def test_get_evicted_after_read(self):
+        cache = _cache.DistanceMatrixCache(self.temp_dir.name, 2 ** 20)
+        cache.put('key', self.dists, self.ids)
+        with mock.patch.object(_cache.os, 'utime',
+                               side_effect=FileNotFoundError):
+            npt.assert_array_equal(cache.get('key'), self.dists)
+
+    def test_evict_vanished_entries(self):
+        cache = _cache.DistanceMatrixCache(self.temp_dir.name, 2 ** 20)
+        cache.put('first', self.dists, self.ids)
+        cache.max_size = 0
+        with mock.patch.object(_cache.os, 'remove',
+                               side_effect=FileNotFoundError):
+            cache.put('second', self.dists, self.ids)
+        listdir = os.listdir
+        with mock.patch.object(_cache.os, 'listdir',
+                               lambda path: listdir(path) + ['gone.npz']):
+            cache.put('third', self.dists, self.ids)
+        self.assertEqual(self.entries(), [])
+
+    def test_concurrent_puts(self):
+        cache = _cache.DistanceMatrixCache(self.temp_dir.name, 2 ** 20)
+        cache.put('probe', self.dists, self.ids)
+        cache.max_size = os.stat(cache._path('probe')).st_size * 2
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda i: (cache.put('key%d' % i, self.dists, self.ids),
+                           cache.get('key%d' % (i - 1))),
+                range(64)))
+        cache.put('last', self.dists, self.ids)
+        self.assertLessEqual(len(self.entries()), 2)
+
+    def test_cache_key(self):
+        keys = {_cache.cache_key('table', 'tree', 'Bray-Curtis', True, 'ebd'),
+                _cache.cache_key('table', 'tree', 'Bray-Curtis', False,
+                                 'ebd'),
+                _cache.cache_key('table', '', 'Bray-Curtis', True, 'ebd'),
+                _cache.cache_key('table', 'tree', 'Soergel', True, 'ebd'),
+                _cache.cache_key('table', 'tree', 'Bray-Curtis', True,
+                                 'native'),
+                _cache.cache_key('table', 'tree', 'Bray-Curtis', True, 'ebd',
+                                 'float32')}
+        self.assertEqual(len(keys), 6)
+
+    def test_table_digest(self):
+        table = make_table()
+        self.assertEqual(_cache.table_digest(table),
+                         _cache.table_digest(table.copy()))
+        self.assertNotEqual(
+            _cache.table_digest(table),
+            _cache.table_digest(table.filter(['s0', 's1'], inplace=False)))
+
+    def test_beta_hit(self):
+        table = make_table()
+        first = beta(table, 'braycurtis', True, engine='native',
+                     cache_dir=self.temp_dir.name)
+        self.assertEqual(len(self.entries()), 1)
+        with mock.patch.object(_method, '_compute',
+                               side_effect=AssertionError('not cached')):
+            second = beta(table, 'braycurtis', True, engine='native',
+                          cache_dir=self.temp_dir.name)
+            # Aliases of the same calculator share the entry
+            sorensen = beta(table, 'sorensen', True, engine='native',
+                            cache_dir=self.temp_dir.name)
+        npt.assert_array_equal(second.to_data_frame().values,
+                               first.to_data_frame().values)
+        npt.assert_array_equal(sorensen.to_data_frame().values,
+                               first.to_data_frame().values)
+        beta(table, 'braycurtis', False, engine='native',
+             cache_dir=self.temp_dir.name)
+        self.assertEqual(len(self.entries()), 2)
+
+
+class OrdinationCacheTests(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='q2-ebd-test-')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_get_put(self):
+        cache = _cache.OrdinationCache(self.temp_dir.name, 2 ** 20)
+        self.assertIsNone(cache.get('key'))
+        ordination = _ordination.pcoa(
+            beta(make_table(), 'braycurtis', True, engine='native'), 2)
+        cache.put('key', ordination)
+        entry = cache.get('key')
+        self.assertEqual(list(entry['ids']), list(ordination.samples.index))
+        npt.assert_array_equal(entry['coordinates'],
+                               ordination.samples.values)
+        npt.assert_array_equal(entry['eigvals'], ordination.eigvals.values)
+        npt.assert_array_equal(entry['proportions'],
+                               ordination.proportion_explained.values)
+
+
+if __name__ == '__main__':
+    unittest.main()
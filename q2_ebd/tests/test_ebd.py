@@ -0,0 +1,206 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import biom
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import qiime2
+import scipy.spatial.distance
+import skbio
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_ebd import beta_stratified, _ebd, _tree
+from q2_ebd.tests.test_method import make_table
+
+
+class EBDFileTests(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='q2-ebd-test-')
+        self.square = np.array([[0, 1, 2, 3],
+                                [1, 0, 4, 5],
+                                [2, 4, 0, 6],
+                                [3, 5, 6, 0]], dtype=float)
+        self.ids = ['a', 'b', 'c', 'd']
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def write_diss(self, name, diagonal):
+        with open(self.path(name), 'w') as fh:
+            fh.write('%d\n' % len(self.ids))
+            for i, sample_id in enumerate(self.ids):
+                values = self.square[i, :i + 1 if diagonal else i].tolist()
+                fh.write('\t'.join([sample_id] + ['%r' % v for v in values])
+                         + '\n')
+        return self.path(name)
+
+    def test_read_diss(self):
+        for diagonal in (False, True):
+            with self.subTest(diagonal=diagonal):
+                dists, ids = _ebd.read_diss(
+                    self.write_diss('output.diss', diagonal))
+                self.assertEqual(ids, self.ids)
+                npt.assert_array_equal(
+                    scipy.spatial.distance.squareform(dists), self.square)
+
+    def test_read_diss_into_out(self):
+        out = np.zeros(6, dtype=np.float32)
+        dists, _ = _ebd.read_diss(self.write_diss('output.diss', False),
+                                  out=out)
+        self.assertIs(dists, out)
+        npt.assert_array_equal(out, [1, 2, 3, 4, 5, 6])
+
+    def test_read_diss_fixture(self):
+        dists, ids = _ebd.read_diss(
+            self.get_data_path('braycurtis-weighted.diss'))
+        self.assertEqual(ids, ['s%d' % i for i in range(6)])
+        self.assertEqual(dists.shape, (15,))
+        self.assertAlmostEqual(dists[0], 0.625731)
+
+    def test_read_diss_malformed(self):
+        with open(self.path('output.diss'), 'w') as fh:
+            fh.write('3\na\nb\t1\n')
+        with self.assertRaisesRegex(ValueError, 'Malformed'):
+            _ebd.read_diss(self.path('output.diss'))
+        with open(self.path('output.diss'), 'w') as fh:
+            fh.write('2\na\nb\t1\t2\t3\t4\n')
+        with self.assertRaisesRegex(ValueError, 'Malformed'):
+            _ebd.read_diss(self.path('output.diss'))
+
+    def test_write_table(self):
+        data = np.array([[0, 3, 1], [2, 0, 0], [0, 0, 7], [5, 1, 0]])
+        for scale in (1, 0.25):
+            with self.subTest(scale=scale):
+                table = biom.Table(data * scale, ['f1', 'f2', 'f3', 'f4'],
+                                   ['s1', 's2', 's3'])
+                _ebd.write_table(table, self.path('table.tsv'))
+                written = pd.read_csv(self.path('table.tsv'), sep='\t',
+                                      index_col=0)
+                self.assertEqual(list(written.index), ['s1', 's2', 's3'])
+                self.assertEqual(list(written.columns),
+                                 ['f1', 'f2', 'f3', 'f4'])
+                npt.assert_array_equal(written.values, data.T * scale)
+
+    def test_write_table_chunks(self):
+        table = biom.Table(np.arange(12).reshape(3, 4), ['f1', 'f2', 'f3'],
+                           ['s1', 's2', 's3', 's4'])
+        chunk_cells = _ebd.CHUNK_CELLS
+        try:
+            _ebd.CHUNK_CELLS = 4
+            _ebd.write_table(table, self.path('chunked.tsv'))
+        finally:
+            _ebd.CHUNK_CELLS = chunk_cells
+        _ebd.write_table(table, self.path('table.tsv'))
+        with open(self.path('chunked.tsv')) as chunked, \
+                open(self.path('table.tsv')) as whole:
+            self.assertEqual(chunked.read(), whole.read())
+
+    def test_write_tree(self):
+        tree = skbio.TreeNode.read(self.get_data_path('tree.nwk'))
+        tree.find('f3').name = "it's a tip"
+        tree.find('f4').name = 'f 4'
+        _ebd.write_tree(_tree.CompactTree.from_treenode(tree),
+                        self.path('tree.nwk'))
+        written = skbio.TreeNode.read(self.path('tree.nwk'))
+        self.assertEqual(sorted(tip.name for tip in written.tips()),
+                         sorted(tip.name for tip in tree.tips()))
+        expected = tree.tip_tip_distances()
+        observed = written.tip_tip_distances().filter(expected.ids)
+        npt.assert_allclose(observed.to_data_frame().values,
+                            expected.to_data_frame().values)
+
+
+class NewickFileTests(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='q2-ebd-test-')
+        self.tree = _tree.CompactTree.from_treenode(
+            skbio.TreeNode.read(self.get_data_path('tree.nwk')))
+        self.cache_dir = self.path('trees')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def work_dir(self, name):
+        os.mkdir(self.path(name))
+        return self.path(name)
+
+    def test_reused(self):
+        first = _ebd.newick_file(self.tree, self.work_dir('a'),
+                                 self.cache_dir)
+        with mock.patch.object(_ebd, 'write_tree',
+                               side_effect=AssertionError('rewritten')):
+            second = _ebd.newick_file(self.tree, self.work_dir('b'),
+                                      self.cache_dir)
+        self.assertEqual(os.path.dirname(second), self.path('b'))
+        with open(first) as fh1, open(second) as fh2:
+            self.assertEqual(fh1.read(), fh2.read())
+
+    def test_eviction_keeps_files_in_use(self):
+        trees = [self.tree.prune(['f%d' % i for i in range(n)])
+                 for n in (2, 3, 4)]
+        with mock.patch.object(_ebd, 'NEWICK_FILES', 2):
+            newicks = [_ebd.newick_file(tree, self.work_dir('w%d' % i),
+                                        self.cache_dir)
+                       for i, tree in enumerate(trees)]
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        for newick_fp in newicks:
+            skbio.TreeNode.read(newick_fp)
+
+    def test_concurrent_groups(self):
+        # Every group of beta_stratified has its own pruned tree, and a group
+        # evicting the others' Newick files must not pull them from under
+        # their ExpressBetaDiversity runs
+        table = make_table()
+        groups = qiime2.CategoricalMetadataColumn(pd.Series(
+            ['a', 'a', 'b', 'b', 'c', 'c'], name='group',
+            index=pd.Index(['s%d' % i for i in range(6)], name='id')))
+
+        # Every group has written its tree before any of them reads it
+        barrier = threading.Barrier(3, timeout=60)
+
+        def run(work_dir, table_fp, calculator, weighted, newick_fp=None,
+                out=None, dtype=np.float64):
+            barrier.wait()
+            skbio.TreeNode.read(newick_fp)
+            with open(table_fp) as fh:
+                ids = [line.split('\t', 1)[0] for line in fh.readlines()[1:]]
+            if out is None:
+                out = np.zeros(len(ids) * (len(ids) - 1) // 2, dtype=dtype)
+            return out, ids
+        with mock.patch.object(_ebd, 'run', run), \
+                mock.patch.object(_ebd, 'NEWICK_FILES', 1):
+            result = beta_stratified(
+                table, 'weighted_unifrac', True, groups,
+                phylogeny=skbio.TreeNode.read(self.get_data_path('tree.nwk')),
+                engine='ebd', cache_dir=self.path('cache'), n_jobs=3)
+        self.assertEqual(sorted(result), ['a', 'b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
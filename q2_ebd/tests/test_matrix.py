@@ -0,0 +1,166 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import biom
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import scipy.spatial.distance
+import skbio
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_ebd import beta, extend, _ebd, _matrix, _native
+from q2_ebd.tests.test_method import make_table, native_run
+
+
+class MatrixTests(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='q2-ebd-test-')
+        self.square = np.array([[0, 1, 2, 3],
+                                [1, 0, 4, 5],
+                                [2, 4, 0, 6],
+                                [3, 5, 6, 0]], dtype=float)
+        self.condensed = scipy.spatial.distance.squareform(self.square)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_allocate(self):
+        dists = _matrix.allocate(4, self.temp_dir.name, np.float32)
+        self.assertIsInstance(dists, np.memmap)
+        self.assertEqual(dists.dtype, np.float32)
+        self.assertEqual(os.listdir(self.temp_dir.name),
+                         [os.path.basename(dists.filename)])
+
+    def test_allocate_empty(self):
+        for n_samples in (0, 1):
+            with self.subTest(n_samples=n_samples):
+                self.assertEqual(
+                    len(_matrix.allocate(n_samples, self.temp_dir.name)), 0)
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+    def test_release(self):
+        dists = _matrix.allocate(4, self.temp_dir.name)
+        _matrix.release(dists)
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+        _matrix.release(np.zeros(6))
+
+    def test_place(self):
+        out = np.zeros(6)
+        _matrix.place(out, 4, slice(0, 2), slice(0, 4), self.square[:2])
+        _matrix.place(out, 4, slice(2, 4), slice(2, 4),
+                      self.square[2:, 2:])
+        npt.assert_array_equal(out, self.condensed)
+
+    def test_reorder(self):
+        order = np.array([2, 0, 3, 1])
+        npt.assert_array_equal(
+            scipy.spatial.distance.squareform(
+                _matrix.reorder(self.condensed, 4, order, band=3)),
+            self.square[np.ix_(order, order)])
+
+    def test_distance_matrix(self):
+        # The result has to survive being written to and read from the
+        # lsmat files QIIME stores distance matrices in
+        for dtype in (np.float64, np.float32):
+            with self.subTest(dtype=dtype):
+                dm = _matrix.distance_matrix(self.condensed.astype(dtype),
+                                             ['a', 'b', 'c', 'd'])
+                self.assertEqual(dm.dtype, dtype)
+                fh = io.StringIO()
+                dm.write(fh)
+                fh.seek(0)
+                npt.assert_array_equal(skbio.DistanceMatrix.read(fh).data,
+                                       self.square)
+
+    def test_block(self):
+        npt.assert_array_equal(
+            _matrix.block(self.condensed, 4, [2, 0], [0, 3, 2]),
+            self.square[np.ix_([2, 0], [0, 3, 2])])
+
+    def test_block_of_one_sample(self):
+        npt.assert_array_equal(_matrix.block(np.zeros(0), 1, [0], [0]),
+                               [[0]])
+
+    def test_one_sample_tiles(self):
+        # 17 samples in blocks of 16 leave a tile of one sample, as does
+        # extending a matrix by one sample, which runs in blocks of one
+        table = biom.Table(np.random.RandomState(0).randint(0, 5, (10, 17)),
+                           ['f%d' % i for i in range(10)],
+                           ['s%d' % i for i in range(17)])
+        expected = beta(table, 'braycurtis', True, engine='native')
+        with mock.patch.object(_ebd, 'run', native_run):
+            self.assertDistanceMatrixClose(
+                beta(table, 'braycurtis', True, engine='ebd', block_size=16),
+                expected)
+            self.assertDistanceMatrixClose(
+                extend(expected.filter(expected.ids[:-1]), table,
+                       'braycurtis', True, engine='ebd'),
+                expected)
+
+    def assertDistanceMatrixClose(self, observed, expected):
+        self.assertEqual(list(observed.ids), list(expected.ids))
+        npt.assert_allclose(observed.to_data_frame().values,
+                            expected.to_data_frame().values)
+
+    def test_ebd_output_in_another_order(self):
+        # The output matrix is reordered into a new memmap and the one EBD
+        # output was parsed into is removed
+        table = make_table()
+        expected = beta(table, 'braycurtis', True, engine='native')
+
+        def run(work_dir, table_fp, calculator, weighted, newick_fp=None,
+                out=None, dtype=np.float64):
+            ids = list(pd.read_csv(table_fp, sep='\t', index_col=0).index)
+            ids = ids[::-1]
+            out[:] = expected.filter(ids).condensed_form()
+            return out, ids
+        with mock.patch.object(_ebd, 'run', run):
+            observed = beta(table, 'braycurtis', True, engine='ebd',
+                            memmap_dir=self.temp_dir.name)
+        npt.assert_allclose(observed.to_data_frame().values,
+                            expected.to_data_frame().values)
+        self.assertEqual(len(os.listdir(self.temp_dir.name)), 1)
+
+    def test_in_process_bands(self):
+        # Without a block size, the in-process engines fill the matrix, in
+        # RAM or disk-backed, a band of rows at a time rather than computing
+        # the square
+        table = make_table()
+        expected = beta(table, 'gower', True, engine='native')
+        pairwise = _native.pairwise
+        for memmap_dir in (None, self.temp_dir.name):
+            shapes = []
+
+            def record_pairwise(X, Y, *args, **kwargs):
+                shapes.append((X.shape[0], Y.shape[0]))
+                return pairwise(X, Y, *args, **kwargs)
+            with self.subTest(memmap_dir=memmap_dir), \
+                    mock.patch.object(_native, 'BLOCK_CELLS', 12), \
+                    mock.patch.object(_native, 'pairwise', record_pairwise):
+                observed = beta(table, 'gower', True, engine='native',
+                                memmap_dir=memmap_dir, precision='float32')
+                self.assertEqual(shapes, [(2, 6), (2, 4), (2, 2)])
+                self.assertEqual(observed.dtype, np.float32)
+                npt.assert_allclose(observed.to_data_frame().values,
+                                    expected.to_data_frame().values,
+                                    rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
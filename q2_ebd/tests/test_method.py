@@ -0,0 +1,501 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import shutil
+import unittest
+from unittest import mock
+
+import biom
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import qiime2
+import scipy.spatial.distance
+import skbio
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_ebd import (beta, beta_many, beta_pairs, beta_phylogenetic,
+                    beta_phylogenetic_many, beta_stratified, extend, query,
+                    _ebd, _method, _native)
+from q2_ebd._method import (non_phylogenetic_metrics, phylogenetic_metrics,
+                            resolve_metric)
+
+
+# The expected output.diss files hold the distances of the measures that
+# have an independent definition in SciPy or scikit-bio, computed with
+# those on the table below and tree.nwk.
+REFERENCE_MEASURES = [('braycurtis', True), ('braycurtis', False),
+                      ('jaccard', False), ('manhattan', True),
+                      ('euclidean', True), ('canberra', True),
+                      ('hellinger', True), ('chi_squared', True)]
+
+PHYLOGENETIC_REFERENCE_MEASURES = [('unweighted_unifrac', False),
+                                   ('weighted_unifrac', True),
+                                   ('normalized_weighted_unifrac', True)]
+
+# Metrics the sparse engine implements
+SPARSE_METRICS = {'braycurtis', 'sorensen', 'canberra', 'coeff_similarity',
+                  'gower', 'jaccard', 'kulczynski', 'lennon', 'manhattan',
+                  'ruzicka', 'soergel', 'unweighted_unifrac',
+                  'weighted_unifrac', 'normalized_weighted_unifrac'}
+
+# Metrics only ExpressBetaDiversity implements
+EBD_ONLY_METRICS = {'complete_tree', 'mnnd', 'mpd'}
+
+HAVE_EBD = shutil.which('ExpressBetaDiversity') is not None
+
+
+def make_table():
+    # The last feature has no counts in any sample
+    return biom.Table(np.array([[10, 0, 3, 2, 0, 7],
+                                [0, 4, 1, 0, 6, 2],
+                                [5, 5, 0, 8, 1, 0],
+                                [0, 0, 9, 1, 3, 4],
+                                [2, 7, 0, 0, 0, 5],
+                                [1, 0, 4, 6, 2, 0],
+                                [0, 3, 2, 0, 8, 1],
+                                [0, 0, 0, 0, 0, 0]]),
+                      ['f%d' % i for i in range(8)],
+                      ['s%d' % i for i in range(6)])
+
+
+def native_run(work_dir, table_fp, calculator, weighted, newick_fp=None,
+               out=None, dtype=np.float64):
+    # Stands in for _ebd.run, computing the distances of the samples in the
+    # table file with the native engine
+    df = pd.read_csv(table_fp, sep='\t', index_col=0)
+    table = biom.Table(df.values.T, list(df.columns), list(df.index))
+    profiles = _native.profiles(table, weighted)
+    dists = scipy.spatial.distance.squareform(
+        _native.pairwise(profiles, profiles, calculator), checks=False)
+    if out is None:
+        out = np.empty(len(dists), dtype=dtype)
+    out[:] = dists
+    return out, list(df.index)
+
+
+class EBDTestBase(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.table = make_table()
+        self.tree = skbio.TreeNode.read(self.get_data_path('tree.nwk'))
+
+    def engines(self, metric):
+        engines = ['native']
+        if metric in SPARSE_METRICS:
+            engines.append('sparse')
+        if HAVE_EBD:
+            engines.append('ebd')
+        return engines
+
+    def expected(self, metric, weighted):
+        dists, ids = _ebd.read_diss(self.get_data_path(
+            '%s-%s.diss' % (metric, 'weighted' if weighted else 'unweighted')))
+        return skbio.DistanceMatrix(
+            scipy.spatial.distance.squareform(dists), ids)
+
+    def assertDistanceMatrixClose(self, observed, expected):
+        self.assertEqual(list(observed.ids), list(expected.ids))
+        npt.assert_allclose(observed.to_data_frame().values,
+                            expected.to_data_frame().values, atol=1e-6)
+
+
+class BetaTests(EBDTestBase):
+    def test_reference_measures(self):
+        for metric, weighted in REFERENCE_MEASURES:
+            for engine in self.engines(metric):
+                with self.subTest(metric=metric, weighted=weighted,
+                                  engine=engine):
+                    self.assertDistanceMatrixClose(
+                        beta(self.table, metric, weighted, engine=engine),
+                        self.expected(metric, weighted))
+
+    def test_phylogenetic_reference_measures(self):
+        for metric, weighted in PHYLOGENETIC_REFERENCE_MEASURES:
+            for engine in self.engines(metric):
+                with self.subTest(metric=metric, engine=engine):
+                    self.assertDistanceMatrixClose(
+                        beta_phylogenetic(self.table, self.tree, metric,
+                                          weighted, engine=engine),
+                        self.expected(metric, weighted))
+
+    def test_ebd_only_metrics(self):
+        for metric in sorted(EBD_ONLY_METRICS):
+            with self.subTest(metric=metric):
+                with self.assertRaisesRegex(ValueError, 'native engine'):
+                    beta_phylogenetic(self.table, self.tree, metric, True,
+                                      engine='native')
+
+    def test_sparse_matches_native(self):
+        for metric in sorted(SPARSE_METRICS - {'unweighted_unifrac',
+                                               'weighted_unifrac',
+                                               'normalized_weighted_unifrac'}):
+            for weighted in (True, False):
+                with self.subTest(metric=metric, weighted=weighted):
+                    self.assertDistanceMatrixClose(
+                        beta(self.table, metric, weighted, engine='sparse'),
+                        beta(self.table, metric, weighted, engine='native'))
+
+    def test_float32(self):
+        for engine in self.engines('braycurtis'):
+            with self.subTest(engine=engine):
+                dm = beta(self.table, 'braycurtis', True, engine=engine,
+                          precision='float32')
+                self.assertEqual(dm.dtype, np.float32)
+                self.assertDistanceMatrixClose(
+                    dm, self.expected('braycurtis', True))
+
+    def test_unknown_engine(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown engine'):
+            beta(self.table, 'braycurtis', True, engine='gpu')
+
+
+class TileTests(EBDTestBase):
+    def test_tiles_match_whole_matrix(self):
+        for metric in ('braycurtis', 'canberra', 'gower', 'pearson'):
+            expected = beta(self.table, metric, True, engine='native')
+            for engine in self.engines(metric):
+                if engine == 'ebd' and metric == 'gower':
+                    continue
+                for block_size in (1, 2, 4):
+                    with self.subTest(metric=metric, engine=engine,
+                                      block_size=block_size):
+                        self.assertDistanceMatrixClose(
+                            beta(self.table, metric, True, engine=engine,
+                                 block_size=block_size, n_jobs=2),
+                            expected)
+
+    def test_phylogenetic_tiles_match_whole_matrix(self):
+        expected = beta_phylogenetic(self.table, self.tree,
+                                     'weighted_unifrac', True,
+                                     engine='native')
+        for engine in self.engines('weighted_unifrac'):
+            with self.subTest(engine=engine):
+                self.assertDistanceMatrixClose(
+                    beta_phylogenetic(self.table, self.tree,
+                                      'weighted_unifrac', True,
+                                      engine=engine, block_size=4),
+                    expected)
+
+    def test_gower_cannot_be_tiled_with_ebd(self):
+        with self.assertRaisesRegex(ValueError, 'Gower'):
+            beta(self.table, 'gower', True, engine='ebd', block_size=2)
+
+    def test_ebd_tile_tables(self):
+        # The samples of a tile are written once for all calculators, and
+        # only while its tasks run
+        written, on_disk = [], []
+        write_table = _ebd.write_table
+
+        def record_write(table, table_fp):
+            written.append(table_fp)
+            write_table(table, table_fp)
+
+        def run(work_dir, table_fp, *args, **kwargs):
+            on_disk.append([name for name
+                            in os.listdir(os.path.dirname(table_fp))
+                            if name.endswith('.tsv')])
+            return native_run(work_dir, table_fp, *args, **kwargs)
+        metrics = {'braycurtis', 'canberra'}
+        with mock.patch.object(_ebd, 'run', run), \
+                mock.patch.object(_ebd, 'write_table', record_write):
+            observed = beta_many(self.table, metrics, unweighted=False,
+                                 engine='ebd', block_size=2)
+        # Three blocks of two samples make six tiles
+        self.assertEqual(len(written), 6)
+        self.assertEqual(len(set(written)), 6)
+        self.assertEqual(len(on_disk), 12)
+        self.assertTrue(all(len(names) == 1 for names in on_disk))
+        expected = beta_many(self.table, metrics, unweighted=False,
+                             engine='native')
+        for key in expected:
+            with self.subTest(key=key):
+                self.assertDistanceMatrixClose(observed[key], expected[key])
+
+
+class ManyTests(EBDTestBase):
+    def test_beta_many(self):
+        observed = beta_many(self.table, {'canberra', 'braycurtis'},
+                             engine='native')
+        self.assertEqual(list(observed), ['braycurtis_weighted',
+                                          'braycurtis_unweighted',
+                                          'canberra_weighted',
+                                          'canberra_unweighted'])
+        for key, dm in observed.items():
+            metric, weighting = key.rsplit('_', 1)
+            with self.subTest(key=key):
+                self.assertDistanceMatrixClose(
+                    dm, beta(self.table, metric, weighting == 'weighted',
+                             engine='native'))
+
+    def test_beta_phylogenetic_many(self):
+        observed = beta_phylogenetic_many(
+            self.table, self.tree, {'weighted_unifrac', 'braycurtis'},
+            unweighted=False, engine='native')
+        self.assertEqual(list(observed), ['braycurtis_weighted',
+                                          'weighted_unifrac_weighted'])
+        for metric in ('braycurtis', 'weighted_unifrac'):
+            with self.subTest(metric=metric):
+                self.assertDistanceMatrixClose(
+                    observed[metric + '_weighted'],
+                    beta_phylogenetic(self.table, self.tree, metric, True,
+                                      engine='native'))
+
+    def test_aliases_computed_once(self):
+        # jaccard, ruzicka and soergel all run the Soergel calculator
+        with mock.patch.object(_method, '_compute',
+                               wraps=_method._compute) as compute:
+            observed = beta_many(self.table, {'jaccard', 'ruzicka',
+                                              'soergel'},
+                                 unweighted=False, engine='native')
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(compute.call_args[0][2], [('Soergel', True)])
+        jaccard = observed['jaccard_weighted']
+        for key in ('ruzicka_weighted', 'soergel_weighted'):
+            with self.subTest(key=key):
+                self.assertDistanceMatrixClose(observed[key], jaccard)
+
+    def test_resolve_metric(self):
+        self.assertEqual(resolve_metric('sorensen', 1, phylogenetic=False),
+                         ('Bray-Curtis', True))
+        self.assertEqual(resolve_metric('unweighted_unifrac', False,
+                                        phylogenetic=True),
+                         ('Soergel', False))
+        self.assertEqual(resolve_metric('weighted_unifrac', True,
+                                        phylogenetic=True),
+                         resolve_metric('manhattan', True,
+                                        phylogenetic=True))
+
+    def test_no_weighting(self):
+        with self.assertRaisesRegex(ValueError, 'weighted and unweighted'):
+            beta_many(self.table, {'braycurtis'}, weighted=False,
+                      unweighted=False, engine='native')
+
+    def test_unknown_metric(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown metrics: nope'):
+            beta_many(self.table, {'braycurtis', 'nope'}, engine='native')
+
+
+class PruneTests(EBDTestBase):
+    # The table has a feature without counts, and pruning the tree down to
+    # the others leaves a single-child node
+    def test_default_matches_unpruned(self):
+        for metric in sorted(non_phylogenetic_metrics()):
+            for weighted in (True, False):
+                with self.subTest(metric=metric, weighted=weighted):
+                    self.assertDistanceMatrixClose(
+                        beta(self.table, metric, weighted, engine='native'),
+                        beta(self.table, metric, weighted, engine='native',
+                             prune=False))
+
+    def test_phylogenetic_default_matches_unpruned(self):
+        for metric in sorted(phylogenetic_metrics() - EBD_ONLY_METRICS):
+            for weighted in (True, False):
+                with self.subTest(metric=metric, weighted=weighted):
+                    self.assertDistanceMatrixClose(
+                        beta_phylogenetic(self.table, self.tree, metric,
+                                          weighted, engine='native'),
+                        beta_phylogenetic(self.table, self.tree, metric,
+                                          weighted, engine='native',
+                                          prune=False))
+
+    def test_pruning_changes_correlations(self):
+        self.assertFalse(np.allclose(
+            beta(self.table, 'pearson', True, engine='native',
+                 prune=True).to_data_frame().values,
+            beta(self.table, 'pearson', True, engine='native',
+                 prune=False).to_data_frame().values))
+
+    def test_default_prunes_invariant_calculators(self):
+        for metric, prunes in (('braycurtis', True), ('pearson', False)):
+            with self.subTest(metric=metric):
+                with mock.patch.object(_method, '_preprocess',
+                                       wraps=_method._preprocess) as prune:
+                    beta(self.table, metric, True, engine='native')
+                self.assertEqual(prune.called, prunes)
+
+
+@unittest.skipUnless(HAVE_EBD, 'ExpressBetaDiversity is not installed')
+class ExpressBetaDiversityTests(EBDTestBase):
+    # The in-process engines reimplement the calculators of the binary
+    def test_native_matches_ebd(self):
+        for metric in sorted(non_phylogenetic_metrics()):
+            for weighted in (True, False):
+                with self.subTest(metric=metric, weighted=weighted):
+                    self.assertDistanceMatrixClose(
+                        beta(self.table, metric, weighted, engine='native'),
+                        beta(self.table, metric, weighted, engine='ebd'))
+
+    def test_phylogenetic_native_matches_ebd(self):
+        for metric in sorted(phylogenetic_metrics() - EBD_ONLY_METRICS):
+            for weighted in (True, False):
+                with self.subTest(metric=metric, weighted=weighted):
+                    self.assertDistanceMatrixClose(
+                        beta_phylogenetic(self.table, self.tree, metric,
+                                          weighted, engine='native'),
+                        beta_phylogenetic(self.table, self.tree, metric,
+                                          weighted, engine='ebd'))
+
+
+class SubsetTests(EBDTestBase):
+    # extend, query and beta_pairs compute parts of the full matrix
+    def setUp(self):
+        super().setUp()
+        self.full = beta(self.table, 'braycurtis', True, engine='native')
+        self.phylogenetic_full = beta_phylogenetic(
+            self.table, self.tree, 'weighted_unifrac', True, engine='native')
+
+    def test_extend(self):
+        old = self.full.filter(['s0', 's1', 's2', 's3'])
+        for engine in self.engines('braycurtis'):
+            with self.subTest(engine=engine):
+                self.assertDistanceMatrixClose(
+                    extend(old, self.table, 'braycurtis', True,
+                           engine=engine),
+                    self.full)
+
+    def test_extend_phylogenetic(self):
+        old = self.phylogenetic_full.filter(['s0', 's1', 's2'])
+        self.assertDistanceMatrixClose(
+            extend(old, self.table, 'weighted_unifrac', True,
+                   phylogeny=self.tree, engine='native', block_size=2),
+            self.phylogenetic_full)
+
+    def test_extend_without_new_samples(self):
+        self.assertIs(extend(self.full, self.table, 'braycurtis', True,
+                             engine='native'), self.full)
+
+    def test_extend_gower(self):
+        with self.assertRaisesRegex(ValueError, 'Gower'):
+            extend(self.full.filter(['s0', 's1']), self.table, 'gower', True,
+                   engine='native')
+
+    def test_query(self):
+        queries, references = ['s1', 's4'], ['s0', 's2', 's3', 's5']
+        for engine in self.engines('braycurtis'):
+            with self.subTest(engine=engine):
+                observed = query(
+                    self.table.filter(queries, inplace=False),
+                    self.table.filter(references, inplace=False),
+                    'braycurtis', True, engine=engine).to_dataframe()
+                self.assertEqual(list(observed.index), queries)
+                self.assertEqual(list(observed.columns), references)
+                npt.assert_allclose(
+                    observed.values,
+                    self.full.to_data_frame().loc[queries, references].values,
+                    atol=1e-6)
+
+    def test_query_shared_sample(self):
+        with self.assertRaisesRegex(ValueError, 's1'):
+            query(self.table.filter(['s0', 's1'], inplace=False),
+                  self.table.filter(['s1', 's2'], inplace=False),
+                  'braycurtis', True, engine='native')
+
+    def test_query_phylogenetic(self):
+        queries, references = ['s0', 's5'], ['s1', 's2', 's3', 's4']
+        observed = query(self.table.filter(queries, inplace=False),
+                         self.table.filter(references, inplace=False),
+                         'weighted_unifrac', True, phylogeny=self.tree,
+                         engine='native', block_size=3).to_dataframe()
+        npt.assert_allclose(
+            observed.values,
+            self.phylogenetic_full.to_data_frame().loc[
+                queries, references].values, atol=1e-6)
+
+    def test_beta_pairs(self):
+        pairs = qiime2.Metadata(pd.DataFrame(
+            {'sample_a': ['s0', 's2', 's3', 's5'],
+             'sample_b': ['s1', 's4', 's2', 's1']},
+            index=pd.Index(['p1', 'p2', 'p3', 'p4'], name='id')))
+        expected = [self.full['s0', 's1'], self.full['s2', 's4'],
+                    self.full['s3', 's2'], self.full['s5', 's1']]
+        for engine in self.engines('braycurtis'):
+            for block_size in (None, 3):
+                with self.subTest(engine=engine, block_size=block_size):
+                    observed = beta_pairs(self.table, 'braycurtis', True,
+                                          pairs=pairs, engine=engine,
+                                          block_size=block_size)
+                    npt.assert_allclose(
+                        observed.to_dataframe()['distance'].values,
+                        expected, atol=1e-6)
+
+    def test_beta_pairs_numeric_ids(self):
+        # Metadata reads these columns as numbers
+        table = self.table.update_ids(
+            {'s%d' % i: '100%d' % i for i in range(6)}, inplace=False)
+        pairs = qiime2.Metadata(pd.DataFrame(
+            {'sample_a': [1000.0, 1002.0], 'sample_b': [1001.0, 1004.0]},
+            index=pd.Index(['p1', 'p2'], name='id')))
+        observed = beta_pairs(table, 'braycurtis', True, pairs=pairs,
+                              engine='native').to_dataframe()
+        self.assertEqual(list(observed['sample_a']), ['1000', '1002'])
+        npt.assert_allclose(observed['distance'].values,
+                            [self.full['s0', 's1'], self.full['s2', 's4']],
+                            atol=1e-6)
+
+    def test_beta_pairs_missing_sample(self):
+        pairs = qiime2.Metadata(pd.DataFrame(
+            {'sample_a': ['s0'], 'sample_b': ['s9']},
+            index=pd.Index(['p1'], name='id')))
+        with self.assertRaisesRegex(ValueError, 's9.*not in the table'):
+            beta_pairs(self.table, 'braycurtis', True, pairs=pairs,
+                       engine='native')
+
+    def test_beta_pairs_from_time_points(self):
+        metadata = qiime2.Metadata(pd.DataFrame(
+            {'subject': ['a', 'a', 'b', 'a', 'b', 'c'],
+             'time': [1.0, 2.0, 1.0, 3.0, 2.0, 1.0]},
+            index=pd.Index(['s%d' % i for i in range(6)], name='id')))
+        observed = beta_pairs(self.table, 'braycurtis', True,
+                              metadata=metadata, subject_column='subject',
+                              time_column='time',
+                              engine='native').to_dataframe()
+        self.assertEqual(list(zip(observed['sample_a'], observed['sample_b'])),
+                         [('s0', 's1'), ('s1', 's3'), ('s2', 's4')])
+        npt.assert_allclose(observed['distance'].values,
+                            [self.full['s0', 's1'], self.full['s1', 's3'],
+                             self.full['s2', 's4']], atol=1e-6)
+
+
+class StratifiedTests(EBDTestBase):
+    def setUp(self):
+        super().setUp()
+        self.groups = qiime2.CategoricalMetadataColumn(pd.Series(
+            ['a', 'b', 'a', None, 'b', 'a'], name='group',
+            index=pd.Index(['s%d' % i for i in range(6)], name='id')))
+
+    def test_beta_stratified(self):
+        # s3 has no group and is left out
+        for phylogeny, metric in ((None, 'braycurtis'),
+                                  (self.tree, 'weighted_unifrac')):
+            with self.subTest(metric=metric):
+                observed = beta_stratified(self.table, metric, True,
+                                           self.groups, phylogeny=phylogeny,
+                                           engine='native', n_jobs=2)
+                self.assertEqual(sorted(observed), ['a', 'b'])
+                for group, ids in (('a', ['s0', 's2', 's5']),
+                                   ('b', ['s1', 's4'])):
+                    table = self.table.filter(ids, inplace=False)
+                    expected = (beta(table, metric, True, engine='native')
+                                if phylogeny is None else
+                                beta_phylogenetic(table, phylogeny, metric,
+                                                  True, engine='native'))
+                    self.assertDistanceMatrixClose(observed[group], expected)
+
+    def test_no_sample_in_a_group(self):
+        with self.assertRaisesRegex(ValueError, 'No sample.*group'):
+            beta_stratified(self.table.filter(['s3'], inplace=False),
+                            'braycurtis', True, self.groups,
+                            engine='native')
+
+
+if __name__ == '__main__':
+    unittest.main()
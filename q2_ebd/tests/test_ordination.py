@@ -0,0 +1,120 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+import warnings
+from unittest import mock
+
+import numpy as np
+import numpy.testing as npt
+import scipy.sparse.linalg
+import scipy.spatial.distance
+import skbio.stats.ordination
+
+from q2_ebd import beta, pcoa_landmark, _ordination
+from q2_ebd.tests.test_method import EBDTestBase
+
+
+class OrdinationTestBase(EBDTestBase):
+    def assertOrdinationClose(self, observed, expected, dimensions):
+        # Axes are only defined up to their sign
+        self.assertEqual(list(observed.samples.index),
+                         list(expected.samples.index))
+        npt.assert_allclose(observed.eigvals.values[:dimensions],
+                            expected.eigvals.values[:dimensions], atol=1e-6)
+        observed = observed.samples.values[:, :dimensions]
+        expected = expected.samples.values[:, :dimensions]
+        signs = np.where(np.sum(observed * expected, axis=0) < 0, -1, 1)
+        npt.assert_allclose(observed * signs, expected, atol=1e-6)
+
+
+class PCoATests(OrdinationTestBase):
+    def setUp(self):
+        super().setUp()
+        points = np.random.RandomState(0).rand(12, 4)
+        self.euclidean = skbio.DistanceMatrix(
+            scipy.spatial.distance.squareform(
+                scipy.spatial.distance.pdist(points)),
+            ['p%d' % i for i in range(12)])
+        self.braycurtis = beta(self.table, 'braycurtis', True,
+                               engine='native')
+
+    def expected(self, dm, dimensions):
+        with warnings.catch_warnings():
+            # About the negative eigenvalues of non-Euclidean distances
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return skbio.stats.ordination.pcoa(
+                dm, number_of_dimensions=dimensions)
+
+    def test_matches_scikit_bio(self):
+        for name, dm in (('euclidean', self.euclidean),
+                         ('braycurtis', self.braycurtis)):
+            for dimensions in (1, 2, 3, len(dm.ids)):
+                with self.subTest(dm=name, dimensions=dimensions):
+                    observed = _ordination.pcoa(dm, dimensions)
+                    self.assertEqual(observed.samples.shape,
+                                     (len(dm.ids), dimensions))
+                    self.assertOrdinationClose(
+                        observed, self.expected(dm, dimensions), dimensions)
+
+    def test_two_samples(self):
+        # The second eigenvalue is zero, and its axis is kept
+        dm = self.braycurtis.filter(['s0', 's1'])
+        observed = _ordination.pcoa(dm, 2)
+        self.assertEqual(list(observed.samples.columns), ['PC1', 'PC2'])
+        self.assertOrdinationClose(observed, self.expected(dm, 2), 2)
+
+    def test_zero_distances(self):
+        dm = skbio.DistanceMatrix(np.zeros((4, 4)), ['a', 'b', 'c', 'd'])
+        for dimensions in (2, 6):
+            with self.subTest(dimensions=dimensions):
+                observed = _ordination.pcoa(dm, dimensions)
+                self.assertEqual(observed.samples.shape, (4, dimensions))
+                self.assertFalse(observed.samples.values.any())
+                self.assertFalse(observed.eigvals.values.any())
+
+    def test_more_dimensions_than_samples(self):
+        observed = _ordination.pcoa(self.braycurtis, 8)
+        self.assertEqual(observed.samples.shape, (6, 8))
+        self.assertFalse(observed.samples.values[:, 6:].any())
+        self.assertOrdinationClose(observed,
+                                   self.expected(self.braycurtis, 6), 6)
+
+    def test_arpack_failure(self):
+        with mock.patch.object(scipy.sparse.linalg, 'eigsh',
+                               side_effect=scipy.sparse.linalg.ArpackError(
+                                   -9)):
+            observed = _ordination.pcoa(self.euclidean, 2)
+        self.assertOrdinationClose(observed,
+                                   self.expected(self.euclidean, 2), 2)
+
+
+class LandmarkTests(OrdinationTestBase):
+    def test_all_landmarks_match_pcoa(self):
+        expected = skbio.stats.ordination.pcoa(
+            beta(self.table, 'braycurtis', True, engine='native'))
+        for seed in (0, 1):
+            with self.subTest(seed=seed):
+                observed = pcoa_landmark(self.table, 'braycurtis', True,
+                                         n_landmarks=6, dimensions=2,
+                                         seed=seed, engine='native')
+                self.assertEqual(observed.samples.shape, (6, 2))
+                self.assertOrdinationClose(observed, expected, 2)
+
+    def test_samples_in_table_order(self):
+        observed = pcoa_landmark(self.table, 'weighted_unifrac', True,
+                                 phylogeny=self.tree, n_landmarks=3,
+                                 dimensions=2, n_check=4, seed=7,
+                                 engine='native')
+        self.assertEqual(list(observed.samples.index),
+                         list(self.table.ids(axis='sample')))
+        self.assertIn('relative error', observed.long_method_name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import threading
+import time
+import unittest
+
+from q2_ebd import beta_many, _parallel
+from q2_ebd.tests.test_method import EBDTestBase
+
+
+class ParallelTests(EBDTestBase):
+    def test_resolve_n_jobs(self):
+        self.assertEqual(_parallel.resolve_n_jobs(3), 3)
+        self.assertGreaterEqual(_parallel.resolve_n_jobs(0), 1)
+        with self.assertRaisesRegex(ValueError, 'n_jobs'):
+            _parallel.resolve_n_jobs(-1)
+
+    def test_map_jobs_keeps_order(self):
+        # Later items finish first
+        def job(i):
+            time.sleep(0.01 * (4 - i))
+            return i, threading.get_ident()
+        results = _parallel.map_jobs(job, range(4), n_jobs=4)
+        self.assertEqual([i for i, _ in results], [0, 1, 2, 3])
+        self.assertGreater(len({thread for _, thread in results}), 1)
+
+    def test_n_jobs_matches_serial(self):
+        metrics = {'braycurtis', 'canberra', 'hellinger'}
+        serial = beta_many(self.table, metrics, engine='native')
+        parallel = beta_many(self.table, metrics, engine='native', n_jobs=3)
+        self.assertEqual(list(parallel), list(serial))
+        for key in serial:
+            with self.subTest(key=key):
+                self.assertDistanceMatrixClose(parallel[key], serial[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import skbio
+from q2_types.distance_matrix import DistanceMatrixDirectoryFormat
+from q2_types.ordination import OrdinationDirectoryFormat
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_ebd import beta, plot, _ordination, _scatter
+from q2_ebd._method import _measure
+from q2_ebd.tests.test_method import make_table
+
+
+BETA_ACTION = """\
+execution:
+    uuid: 6b1f8e0e-0000-4000-8000-000000000001
+action:
+    type: method
+    plugin: !ref 'environment:plugins:ebd'
+    action: beta
+    inputs:
+    -   table: 6b1f8e0e-0000-4000-8000-00000000000a
+    parameters:
+    -   metric: braycurtis
+    -   weighted: true
+    -   engine: native
+    output-name: distance_matrix
+"""
+
+BETA_MANY_ACTION = """\
+action:
+    type: method
+    plugin: !ref 'environment:plugins:ebd'
+    action: beta_many
+    inputs:
+    -   table: 6b1f8e0e-0000-4000-8000-00000000000a
+    parameters:
+    -   metrics: !set
+        - braycurtis
+        - jaccard
+    -   weighted: true
+    -   unweighted: %s
+    output-name: %s
+"""
+
+IMPORT_ACTION = """\
+action:
+    type: import
+    format: BIOMV210DirFmt
+    manifest:
+    -   name: feature-table.biom
+        md5sum: 0123456789abcdef0123456789abcdef
+"""
+
+PCOA_ACTION = """\
+action:
+    type: method
+    plugin: !ref 'environment:plugins:diversity'
+    action: pcoa
+    inputs:
+    -   distance_matrix: %s
+    parameters:
+    -   number_of_dimensions: null
+    output-name: pcoa
+"""
+
+OTHER_BETA_ACTION = BETA_ACTION.replace('braycurtis', 'canberra')
+
+
+class PlotTestBase(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='q2-ebd-test-')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def artifact(self, uuid, action_yaml, ancestors=()):
+        # The layout of an extracted artifact: data/, metadata.yaml and the
+        # action.yaml of it and of its ancestors under provenance/
+        root = os.path.join(self.temp_dir.name, uuid)
+        os.makedirs(os.path.join(root, 'data'))
+        with open(os.path.join(root, 'metadata.yaml'), 'w') as fh:
+            fh.write('uuid: %s\ntype: DistanceMatrix\n' % uuid)
+        actions = [(os.path.join(root, 'provenance'), action_yaml)]
+        actions += [(os.path.join(root, 'provenance', 'artifacts', ancestor),
+                     ancestor_yaml) for ancestor, ancestor_yaml in ancestors]
+        for provenance, yaml in actions:
+            os.makedirs(os.path.join(provenance, 'action'))
+            with open(os.path.join(provenance, 'action', 'action.yaml'),
+                      'w') as fh:
+                fh.write(yaml)
+        return os.path.join(root, 'data')
+
+    def distance_matrix(self, uuid, dm, action_yaml=BETA_ACTION):
+        data = self.artifact(uuid, action_yaml)
+        dm.write(os.path.join(data, 'distance-matrix.tsv'))
+        return DistanceMatrixDirectoryFormat(data, mode='r')
+
+    def ordination(self, uuid, ordination, action_yaml, ancestors=()):
+        data = self.artifact(uuid, action_yaml, ancestors)
+        ordination.write(os.path.join(data, 'ordination.txt'))
+        return OrdinationDirectoryFormat(data, mode='r')
+
+    def plot(self, *args, **kwargs):
+        output_dir = tempfile.mkdtemp(dir=self.temp_dir.name)
+        plot(output_dir, *args, **kwargs)
+        with open(os.path.join(output_dir, 'ebd.html')) as fh:
+            return output_dir, fh.read()
+
+    def frames(self, *args, **kwargs):
+        # The sample ids and (measure, coordinates) pairs plot saves
+        with mock.patch.object(_scatter, 'save_embedded') as save:
+            plot(tempfile.mkdtemp(dir=self.temp_dir.name), *args, **kwargs)
+        _, samples, frames, _ = save.call_args[0]
+        return list(samples), frames
+
+
+class MeasureTests(PlotTestBase):
+    def test_beta(self):
+        self.assertEqual(_measure(self.artifact('a', BETA_ACTION)),
+                         'braycurtis_weighted')
+
+    def test_collection_member(self):
+        self.assertEqual(
+            _measure(self.artifact('a', BETA_MANY_ACTION % (
+                'true', '\n    - distance_matrices\n    - jaccard_unweighted'
+                '\n    - 4\n    - 4'))),
+            'jaccard_unweighted')
+
+    def test_many_without_key(self):
+        # Every member of the collection has the same parameters
+        self.assertEqual(
+            _measure(self.artifact('a', BETA_MANY_ACTION % (
+                'true', 'distance_matrices'))),
+            'a')
+
+    def test_pcoa(self):
+        # The ancestors are searched from the input of the PCoA, not in the
+        # order of their UUIDs
+        self.assertEqual(
+            _measure(self.artifact('p', PCOA_ACTION % 'b', [
+                ('a', OTHER_BETA_ACTION), ('b', BETA_ACTION),
+                ('t', IMPORT_ACTION)])),
+            'braycurtis_weighted')
+
+    def test_pcoa_of_import(self):
+        self.assertEqual(
+            _measure(self.artifact('p', PCOA_ACTION % 't', [
+                ('t', IMPORT_ACTION)])),
+            'p')
+
+    def test_import(self):
+        self.assertEqual(_measure(self.artifact('a', IMPORT_ACTION)), 'a')
+
+
+class PlotTests(PlotTestBase):
+    def setUp(self):
+        super().setUp()
+        self.table = make_table()
+
+    def test_two_samples(self):
+        # The second axis has no variance and is plotted at zero
+        dm = beta(self.table.filter(['s0', 's1'], inplace=False),
+                  'braycurtis', True, engine='native')
+        _, html = self.plot([self.distance_matrix('a', dm)])
+        self.assertIn('braycurtis_weighted', html)
+
+    def test_zero_distances(self):
+        dm = skbio.DistanceMatrix(np.zeros((4, 4)), ['s0', 's1', 's2', 's3'])
+        _, html = self.plot([self.distance_matrix('a', dm)])
+        self.assertIn('braycurtis_weighted', html)
+
+    def test_parallel(self):
+        metrics = ('braycurtis', 'canberra', 'euclidean', 'hellinger')
+        matrices = [self.distance_matrix(
+            metric, beta(self.table, metric, True, engine='native'),
+            BETA_ACTION.replace('braycurtis', metric)) for metric in metrics]
+        samples, expected = self.frames(matrices)
+        threads = set()
+        pcoa = _ordination.pcoa
+
+        def record_pcoa(*args):
+            threads.add(threading.get_ident())
+            time.sleep(0.05)
+            return pcoa(*args)
+        with mock.patch.object(_ordination, 'pcoa', record_pcoa):
+            observed_samples, observed = self.frames(matrices, n_jobs=4)
+        self.assertGreater(len(threads), 1)
+        self.assertEqual(observed_samples, samples)
+        self.assertEqual([measure for measure, _ in observed],
+                         ['%s_weighted' % metric for metric in metrics])
+        for (_, observed_points), (_, expected_points) in zip(observed,
+                                                              expected):
+            # Axes are only defined up to their sign
+            signs = np.sign(np.sum(observed_points * expected_points,
+                                   axis=0))
+            np.testing.assert_allclose(observed_points * signs,
+                                       expected_points, atol=1e-10)
+
+    def test_nothing_to_plot(self):
+        with self.assertRaisesRegex(ValueError, 'Provide'):
+            plot(self.temp_dir.name)
+
+    def test_pcoa_results(self):
+        # Precomputed ordinations are plotted as they are, labelled by the
+        # matrix they were computed from
+        braycurtis = beta(self.table, 'braycurtis', True, engine='native')
+        ordination = _ordination.pcoa(braycurtis, 3)
+        canberra = beta(self.table, 'canberra', True, engine='native')
+        samples, frames = self.frames(
+            [self.distance_matrix(
+                'c', canberra, BETA_ACTION.replace('braycurtis', 'canberra'))],
+            pcoa=[self.ordination('p', ordination, PCOA_ACTION % 'b',
+                                  [('b', BETA_ACTION)])])
+        self.assertEqual(samples, list(braycurtis.ids))
+        self.assertEqual([measure for measure, _ in frames],
+                         ['canberra_weighted', 'braycurtis_weighted'])
+        np.testing.assert_allclose(frames[1][1],
+                                   ordination.samples.values[:, :2])
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.temp_dir.name, 'cache')
+        matrix = self.distance_matrix(
+            'a', beta(self.table, 'braycurtis', True, engine='native'))
+        _, expected = self.frames([matrix], cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        with mock.patch.object(_ordination, 'pcoa',
+                               side_effect=AssertionError('not cached')):
+            _, observed = self.frames([matrix], cache_dir=cache_dir)
+        self.assertEqual(observed[0][0], 'braycurtis_weighted')
+        np.testing.assert_array_equal(observed[0][1], expected[0][1])
+        # Ordinations with another number of axes are cached separately
+        self.frames([matrix], cache_dir=cache_dir, dimensions=3)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import qiime2
+
+from q2_ebd import _scatter
+
+
+class ScatterTestBase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='q2-ebd-test-')
+        self.samples = ['s0', 's1', 's2']
+        self.frames = [
+            ('braycurtis_weighted',
+             np.array([[0.5, -0.25], [0.0, 1.0], [-0.5, -0.75]])),
+            ('canberra_weighted',
+             np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]))]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def html(self, html_name='ebd.html'):
+        with open(os.path.join(self.temp_dir.name, html_name)) as fh:
+            return fh.read()
+
+    def source(self, save, *args, **kwargs):
+        # The columns of the data source the page is built from
+        with mock.patch.object(_scatter, '_save') as _save:
+            save(self.temp_dir.name, self.samples, self.frames, *args,
+                 **kwargs)
+        return _save.call_args[0][2]
+
+
+class LazyTests(ScatterTestBase):
+    def test_sidecars(self):
+        _scatter.save_lazy(self.temp_dir.name, self.samples, self.frames)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.temp_dir.name,
+                                           _scatter.FRAMES_DIR))),
+            ['0.f32', '1.f32'])
+        for i, (_, coordinates) in enumerate(self.frames):
+            with self.subTest(i=i):
+                values = np.fromfile(
+                    os.path.join(self.temp_dir.name, _scatter.FRAMES_DIR,
+                                 '%d.f32' % i), dtype='<f4')
+                # The x coordinates of all samples, then the y coordinates
+                npt.assert_array_equal(values,
+                                       coordinates.T.ravel().astype('<f4'))
+
+    def test_page(self):
+        _scatter.save_lazy(self.temp_dir.name, self.samples, self.frames,
+                           html_name='lazy.html')
+        html = self.html('lazy.html')
+        for i, (measure, _) in enumerate(self.frames):
+            self.assertIn('%s/%d.f32' % (_scatter.FRAMES_DIR, i), html)
+            self.assertIn(measure, html)
+
+    def test_source(self):
+        # Only the first measure is embedded in the page
+        data = self.source(_scatter.save_lazy)
+        self.assertEqual(sorted(data), ['sample-id', 'x', 'y'])
+        self.assertEqual(data['x'].dtype, np.float32)
+        npt.assert_array_equal(data['x'], self.frames[0][1][:, 0])
+        npt.assert_array_equal(data['y'], self.frames[0][1][:, 1])
+
+
+class EmbeddedTests(ScatterTestBase):
+    def test_page(self):
+        _scatter.save_embedded(self.temp_dir.name, self.samples, self.frames)
+        html = self.html()
+        for measure, _ in self.frames:
+            self.assertIn(measure, html)
+
+    def test_source(self):
+        # Sample ids are stored once, next to two columns per measure
+        data = self.source(_scatter.save_embedded)
+        self.assertEqual(sorted(data), ['sample-id', 'x0', 'x1', 'y0', 'y1'])
+        self.assertEqual(data['sample-id'], self.samples)
+        for i, (_, coordinates) in enumerate(self.frames):
+            with self.subTest(i=i):
+                self.assertEqual(data['x%d' % i].dtype, np.float32)
+                npt.assert_array_equal(data['x%d' % i], coordinates[:, 0])
+                npt.assert_array_equal(data['y%d' % i], coordinates[:, 1])
+
+    def test_metadata(self):
+        # Metadata follows the plotted samples, whatever its own order, and
+        # gets positional column names shown under their real names; missing
+        # values are left blank
+        metadata = qiime2.Metadata(pd.DataFrame(
+            {'x0': ['b', 'a', 'c'], 'depth': [3.0, None, 1.0]},
+            index=pd.Index(['s1', 's0', 's3'], name='id')))
+        data, tooltips = _scatter._source_data(self.samples, metadata)
+        self.assertEqual(data['sample-id'], self.samples)
+        self.assertEqual(data['metadata-0'], ['a', 'b', ''])
+        self.assertEqual(data['metadata-1'], ['', '3.0', ''])
+        self.assertEqual(tooltips, [('id', '@{sample-id}'),
+                                    ('x0', '@{metadata-0}'),
+                                    ('depth', '@{metadata-1}')])
+
+
+if __name__ == '__main__':
+    unittest.main()
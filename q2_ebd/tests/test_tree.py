@@ -0,0 +1,74 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2018, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+import skbio
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_ebd import _tree
+
+
+class CompactTreeTests(TestPluginBase):
+    package = 'q2_ebd.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.phylogeny = skbio.TreeNode.read(self.get_data_path('tree.nwk'))
+        self.tree = _tree.CompactTree.from_treenode(self.phylogeny)
+        self.tips = ['f%d' % i for i in range(8)]
+
+    def paths(self, tree, tips):
+        # Tip-to-tip and root-to-tip path lengths, through the branches each
+        # tip lies below
+        incidence, lengths = tree.branch_incidence(tips)
+        incidence = incidence.toarray()
+        tip_tip = np.abs(incidence[:, None, :]
+                         - incidence[None, :, :]) @ lengths
+        return tip_tip, incidence @ lengths
+
+    def test_from_treenode(self):
+        self.assertEqual(len(self.tree), 15)
+        self.assertEqual(self.tree.names[-1], None)
+        self.assertEqual(self.tree.size[-1], 15)
+        self.assertEqual(sorted(self.tree.tip_index), self.tips)
+        self.assertIs(_tree.CompactTree.from_treenode(self.phylogeny.copy()),
+                      self.tree)
+
+    def test_branch_incidence(self):
+        tip_tip, root_tip = self.paths(self.tree, self.tips)
+        expected = self.phylogeny.tip_tip_distances().filter(self.tips)
+        npt.assert_allclose(tip_tip, expected.data)
+        npt.assert_allclose(
+            root_tip, [self.phylogeny.find(tip).distance(self.phylogeny)
+                       for tip in self.tips])
+
+    def test_prune(self):
+        # Dropping f2 leaves its sibling f3 as a single child, and dropping
+        # the tips of the second clade leaves the first as the root's only
+        # child, which is kept as a stem
+        for kept in (['f0', 'f1', 'f3', 'f5', 'f7'], ['f0', 'f1', 'f3']):
+            with self.subTest(kept=kept):
+                pruned = self.tree.prune(kept)
+                self.assertEqual(sorted(pruned.tip_index), kept)
+                self.assertTrue((np.diff(pruned.child_ptr)[:-1] != 1).all())
+                tip_tip, root_tip = self.paths(pruned, kept)
+                expected_tip_tip, expected_root_tip = self.paths(self.tree,
+                                                                 kept)
+                npt.assert_allclose(tip_tip, expected_tip_tip)
+                npt.assert_allclose(root_tip, expected_root_tip)
+
+    def test_prune_unknown_tip(self):
+        with self.assertRaisesRegex(ValueError, 'f9'):
+            self.tree.prune(['f0', 'f9'])
+
+
+if __name__ == '__main__':
+    unittest.main()